@@ -0,0 +1,207 @@
+"""
+A compact binary format for the nonordering proofs described in
+check_proof.py.
+
+In the JSON format each leaf repeats the whole path of edge labels
+from the root, so a deep tree stores the same prefixes many times.
+Here the tree is stored once, in preorder, as follows.  Each vertex
+is given by its number of children and the labels of the edges to
+them, followed by the children themselves.  The edge labels are
+interned: they are stored once, in a table at the start, and
+referred to by their index in it.  A leaf is given by 0 children
+followed by its word, as the positions along the path from the root
+of the edge labels it uses.  All numbers are unsigned LEB128
+varints, and everything after the magic bytes is compressed with
+zlib.
+
+Only data which really is a tree can be stored, so to_binary raises
+ValueError for claims which are not the leaves of a rooted tree or
+whose words use labels not on their paths; these would fail
+check_proof anyway.  The leaves come back in preorder, which is the
+order ProofPrinter writes them in.
+
+>>> import json
+>>> proof = json.loads(SAMPLE)
+>>> data = to_binary(proof)
+>>> from_binary(data) == proof
+True
+>>> len(data) < len(SAMPLE)
+True
+>>> to_binary({'name':'x', 'gens':'a', 'rels':[], 'group_args':[1, 1, 0],
+...            'proof':[['a.b', 'b.c']]})
+Traceback (most recent call last):
+...
+ValueError: Leaf a.b uses c, which is not on its path
+"""
+
+import json, sys, zlib
+
+MAGIC = b'QDPF\x01'
+
+SAMPLE = """{"name":"m003(-3,1)","group_args":[1,1,0],"gens":"a.b.c",
+"rels":["abbcb","ccAcAB","aabcc"],"proof":[["a.b","b.a.b.a.b.b.a.a.a.b"],
+["a.B.c","a.B.c.a.a.c.c"],["a.B.C","C.a.C.a.a.B"]]}"""
+
+def write_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def read_varint(data, i):
+    """
+    The number starting at data[i], and the position after it.
+    """
+    n, shift = 0, 0
+    while True:
+        byte = data[i]
+        i += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, i
+        shift += 7
+
+def write_string(out, string):
+    encoded = string.encode('utf-8')
+    write_varint(out, len(encoded))
+    out.extend(encoded)
+
+def read_string(data, i):
+    n, i = read_varint(data, i)
+    return data[i:i + n].decode('utf-8'), i + n
+
+def build_trie(claims):
+    """
+    The tree whose leaves are the given claims, as nested pairs
+    [children, word] where children maps each edge label to a child
+    and word is None except at the leaves.
+    """
+    root = [dict(), None]
+    for path, word in claims:
+        vertex = root
+        for label in path:
+            if vertex[1] is not None:
+                raise ValueError('Leaf %s is not at the end of a path' % '.'.join(path))
+            vertex = vertex[0].setdefault(label, [dict(), None])
+        if vertex[0] or vertex[1] is not None:
+            raise ValueError('Leaf %s is not a leaf of the tree' % '.'.join(path))
+        vertex[1] = (path, word)
+    return root
+
+def to_binary(proof):
+    """
+    Converts a proof, given as a dict or its JSON string, to bytes.
+    """
+    if isinstance(proof, str):
+        proof = json.loads(proof)
+    claims = [(a.split('.'), b.split('.')) for a, b in proof['proof']]
+    root = build_trie(claims)
+    labels = dict()
+    for path, word in claims:
+        for label in path:
+            labels.setdefault(label, len(labels))
+
+    out = bytearray()
+    header = dict((key, value) for key, value in proof.items() if key != 'proof')
+    write_string(out, json.dumps(header, separators=(',', ':')))
+    write_varint(out, len(labels))
+    for label in labels:
+        write_string(out, label)
+
+    stack = [root]
+    while stack:
+        children, leaf = stack.pop()
+        write_varint(out, len(children))
+        if leaf is not None:
+            path, word = leaf
+            positions = dict()
+            for i, label in enumerate(path):
+                positions.setdefault(label, i)
+            write_varint(out, len(word))
+            for label in word:
+                if label not in positions:
+                    raise ValueError('Leaf %s uses %s, which is not on its path' %
+                                     ('.'.join(path), label))
+                write_varint(out, positions[label])
+        for label in children:
+            write_varint(out, labels[label])
+        # Pushed in reverse, so that the children come off the stack
+        # in order.
+        stack.extend(reversed(list(children.values())))
+    return MAGIC + zlib.compress(bytes(out))
+
+def from_binary(data):
+    """
+    Converts bytes written by to_binary back to a proof, as a dict in
+    the JSON format.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a binary proof')
+    data = zlib.decompress(data[len(MAGIC):])
+    header, i = read_string(data, 0)
+    proof = json.loads(header)
+    num_labels, i = read_varint(data, i)
+    labels = []
+    for _ in range(num_labels):
+        label, i = read_string(data, i)
+        labels.append(label)
+
+    leaves = []
+    # Each entry is the path to a vertex still to be read.
+    stack = [[]]
+    while stack:
+        path = stack.pop()
+        num_children, i = read_varint(data, i)
+        if num_children == 0 and path:
+            length, i = read_varint(data, i)
+            word = []
+            for _ in range(length):
+                position, i = read_varint(data, i)
+                word.append(path[position])
+            leaves.append(['.'.join(path), '.'.join(word)])
+        children = []
+        for _ in range(num_children):
+            k, i = read_varint(data, i)
+            children.append(path + [labels[k]])
+        stack.extend(reversed(children))
+    proof['proof'] = leaves
+    return proof
+
+def to_json(data):
+    """
+    The JSON string, as written by ProofPrinter, of the proof stored
+    in data by to_binary.
+    """
+    return json.dumps(from_binary(data), separators=(',', ':'))
+
+def load(path):
+    """
+    Reads a proof from a file in either format, returning a dict.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    if data[:len(MAGIC)] == MAGIC:
+        return from_binary(data)
+    return json.loads(data.decode('utf-8'))
+
+def convert(source, target):
+    """
+    Converts the proof in the file source to the other format, writing
+    it to the file target.
+    """
+    with open(source, 'rb') as file:
+        data = file.read()
+    if data[:len(MAGIC)] == MAGIC:
+        with open(target, 'w') as file:
+            file.write(to_json(data) + '\n')
+    else:
+        with open(target, 'wb') as file:
+            file.write(to_binary(data.decode('utf-8')))
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        convert(sys.argv[1], sys.argv[2])
+    else:
+        import doctest
+        results = doctest.testmod()
+        print('binary_proof:%s' % (results,))
@@ -27,6 +27,15 @@ list of its leaves, where each leaf is given by a pair consisting of:
 2. The vertex label of the leaf itself, which is a word in the edge
    labels that is 1 in the group.
 
+Proofs can also be stored in the much smaller binary format of
+binary_proof.py, which check_proof accepts as bytes.
+
+A large proof can be checked by a pool of processes with
+check_proof_parallel, and a whole directory or tarball of proofs with
+check_proofs, also available as::
+
+    sage -python check_proof.py proofs.tar results.jsonl [workers]
+
 You can access the stored proofs either by name or at random::
 
 >>> pf = load_proof_by_name('o9_41374(5, 1)')
@@ -37,10 +46,10 @@ True
 True
 """
 
-import random, json, os, sys, tarfile
+import random, json, os, sys, tarfile, multiprocessing
 import snappy
 import word_problem
-import networkx as nx
+import binary_proof
 
 # The example from the top of this file
 sample1 = json.loads(sys.modules[__name__].__doc__.split('\n\n')[1])
@@ -56,6 +65,7 @@ def build_graph(claims):
     Given a list of claims corresponding to the leaves of a
     nonordering proof tree, build the tree itself as a graph.
     """
+    import networkx as nx
     paths = paths_to_root(claims)
     T = nx.DiGraph()
     T.add_node('1')
@@ -74,61 +84,114 @@ def tree_ok(claims):
     """
     Given a list of claims corresponding to the leaves of a
     nonordering proof tree, checks that the data really defines a
-    directed trivalent tree with a unique root vertex.
+    directed trivalent tree with a unique root vertex.  That is, the
+    root has a single edge out of it, every other vertex is either a
+    leaf, given by exactly one claim, or has two edges out of it
+    labelled by inverse words.
+
+    The tree is built as a trie of nested dicts, one for each vertex,
+    mapping the labels of the edges out of it to the vertices they
+    lead to; at a leaf, the key None is set.  So the time and memory
+    needed are linear in the total length of the paths.
+
+    >>> claims = proof_claims(sample1)
+    >>> tree_ok(claims)
+    True
+    >>> tree_ok(claims[:2])
+    False
+    >>> tree_ok(claims + claims[:1])
+    False
+    >>> tree_ok([(['a', 'b'], ['b']), (['a', 'b', 'c'], ['c'])])
+    False
     """
-    T, leaves = build_graph(claims)
-
-    # A branching is a directed forest where every vertex has in-degree
-    # a most 1.            
-    if not nx.is_branching(T):
+    root = dict()
+    for path, word in claims:
+        vertex = root
+        for label in path:
+            child = vertex.get(label)
+            if child is None:
+                child = vertex[label] = dict()
+            vertex = child
+        # The same leaf twice.
+        if None in vertex:
+            return False
+        vertex[None] = True
+
+    if len(root) != 1:
         return False
-
-    # Now check that the tree is trivalent.
-    degrees = T.degree()
-    leaf_count = 0
-    for v in T.nodes():
-        if v in leaves:
-            if degrees[v] != 1:
+    stack = list(root.values())
+    while stack:
+        vertex = stack.pop()
+        if None in vertex:
+            if len(vertex) != 1:
                 return False
-            leaf_count += 1
         else:
-            if degrees[v] != 3:
+            if len(vertex) != 2:
                 return False
-            # Check the outgoing edges of this interior vertex
-            # labelled by inverse words.
-            w0, w1 = [attr['label'] for attr in T.adj[v].values()]
+            (w0, v0), (w1, v1) = vertex.items()
             if invert_word(w0) != w1:
                 return False
+            stack.append(v0)
+            stack.append(v1)
+    return True
 
-    # Make sure there wasn't any redundancy in the path data.
-    if leaf_count != len(leaves):
-        return False
+def edge_labels(claims):
+    labels = set()
+    for path, word in claims:
+        labels.update(path)
+    return labels
 
-    # This should be redundant, but might as well check. 
-    paths_from_root = nx.single_source_shortest_path(T, '1')
-    for v, path in paths_from_root.items():
-        for p in path:
-            if not v.startswith(p):
-                return False
-    return True
-    
 def all_nontrivial_edge_labels(solver, claims):
-    edge_labels = set(sum(paths_to_root(claims), []))
-    return all(solver.is_nontrivial(e) for e in edge_labels)
+    return all(solver.is_nontrivial_labels([e]) for e in edge_labels(claims))
 
 def check_claim(solver, claim):
     path_to_root, trivial_word = claim
-    is_one = solver.is_trivial(''.join(trivial_word))    
     valid_words = set(path_to_root)
-    return set(trivial_word).issubset(valid_words) and is_one
+    if not set(trivial_word).issubset(valid_words):
+        return False
+    return solver.is_trivial_labels(trivial_word)
 
-def check_proof(proof, bits_prec=100):
+def check_edge_or_claim(solver, item):
     """
-    This is the main function for rigorously verifying that a
-    nonordering proof tree is valid.  
+    Checks either that an edge label is nontrivial or, for a claim,
+    that its leaf word is trivial.
+    """
+    if isinstance(item, str):
+        return solver.is_nontrivial_labels([item])
+    return check_claim(solver, item)
+
+def load_proof(proof):
     """
+    The proof as a dict, given either that or its JSON or binary form.
+    Bytes can hold either form, as when read from a tarball.
+
+    >>> import io, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'proofs.tar')
+    >>> with tarfile.open(path, 'w') as tar:
+    ...     for name, data in [('proofs/json', json.dumps(sample1).encode()),
+    ...                        ('proofs/binary', binary_proof.to_binary(sample1))]:
+    ...         info = tarfile.TarInfo(name)
+    ...         info.size = len(data)
+    ...         tar.addfile(info, io.BytesIO(data))
+    >>> proof_names(path)
+    ['proofs/binary', 'proofs/json']
+    >>> with tarfile.open(path) as tar:
+    ...     [load_proof(tar.extractfile(name).read()) == sample1
+    ...      for name in proof_names(path)]
+    [True, True]
+    """
+    if isinstance(proof, bytes):
+        if proof.startswith(binary_proof.MAGIC):
+            return binary_proof.from_binary(proof)
+        proof = proof.decode('utf-8')
     if isinstance(proof, str):
         proof = json.loads(proof)
+    return proof
+
+def proof_claims(proof):
+    return [(a.split('.'), b.split('.')) for a, b in proof['proof']]
+
+def make_solver(proof, bits_prec):
     M = snappy.Manifold(proof['name'])
     solver = word_problem.WordProblemSolver(M, bits_prec=bits_prec,
                              fundamental_group_args=proof['group_args'])
@@ -137,9 +200,16 @@ def check_proof(proof, bits_prec=100):
     # but it's hard to imagine that we will succeed if they fail.
     assert solver.rho.generators() == proof['gens'].split('.')
     assert solver.rho.relators() == proof['rels']
+    return solver
 
-    claims = proof['proof']
-    claims = [(a.split('.'), b.split('.')) for a, b in claims]
+def check_proof(proof, bits_prec=100):
+    """
+    This is the main function for rigorously verifying that a
+    nonordering proof tree is valid.  
+    """
+    proof = load_proof(proof)
+    solver = make_solver(proof, bits_prec)
+    claims = proof_claims(proof)
     a0 = tree_ok(claims)
     if not a0:
         return False
@@ -147,18 +217,56 @@ def check_proof(proof, bits_prec=100):
     a2 = all(check_claim(solver, c) for c in claims)
     return a0 and a1 and a2
 
-def check_proof_harder(proof, max_bits=1000):
+def check_proof_harder(proof, max_bits=1000, solvers=None):
     """
     Try to check the given proof at higher and higher precisions until
-    we succeed or pass max_bits precision.
+    we succeed or pass max_bits precision.  The tree is checked once,
+    and an edge label or claim verified at one precision is not
+    checked again: only those which raised WordProblemError are
+    retried at twice the precision.  Returns whether the proof is
+    valid and the precision at which this was decided.
+
+    The solvers are kept in the dict solvers, keyed by the manifold,
+    the fundamental group arguments and bits_prec, which can be
+    passed in to share them between calls, even for different proofs.
     """
+    proof = load_proof(proof)
+    claims = proof_claims(proof)
+    if not tree_ok(claims):
+        return False, 100
+    items = sorted(edge_labels(claims)) + claims
+    return check_items_harder(proof, items, max_bits, solvers)
+
+def check_items_harder(proof, items, max_bits=1000, solvers=None):
+    """
+    Checks the given edge labels and claims of the proof as in
+    check_proof_harder, assuming the tree has been checked.
+    """
+    if solvers is None:
+        solvers = dict()
+    pending = items
     bits = 100
-    while bits <= 1000:
+    group = (proof['name'], tuple(proof['group_args']))
+    while bits <= max_bits:
         try:
-            ans = check_proof(proof, bits)
-            return ans, bits
+            key = group + (bits,)
+            if key not in solvers:
+                solvers[key] = make_solver(proof, bits)
+            solver = solvers[key]
         except word_problem.WordProblemError:
             bits = 2*bits
+            continue
+        unresolved = []
+        for item in pending:
+            try:
+                if not check_edge_or_claim(solver, item):
+                    return False, bits
+            except word_problem.WordProblemError:
+                unresolved.append(item)
+        if not unresolved:
+            return True, bits
+        pending = unresolved
+        bits = 2*bits
     return False, bits
 
 
@@ -175,7 +283,7 @@ else:
 def load_proof_by_name(name):
     if not name.startswith('proofs/'):
         name = 'proofs/' + name
-    return json.loads(proof_tarball.extractfile(name).read())
+    return load_proof(proof_tarball.extractfile(name).read())
 
 def random_proof():
     proofs = [name for name in proof_tarball.getnames()
@@ -221,7 +329,119 @@ def proof_sizes():
     return num_edges, num_leaves, max_trivial_word
 
 
+# Verifying in parallel
+
+_worker = dict()
+
+def _start_worker(proof, archive):
+    _worker.clear()
+    _worker.update(proof=proof, solvers=dict(), archive=None)
+    if archive is not None and not os.path.isdir(archive):
+        _worker['archive'] = tarfile.open(archive, 'r')
+    else:
+        _worker['archive'] = archive
+
+def _check_chunk(task):
+    items, max_bits = task
+    return check_items_harder(_worker['proof'], items, max_bits, _worker['solvers'])
+
+def check_proof_parallel(proof, workers=4, max_bits=1000, chunks_per_worker=4):
+    """
+    Same as check_proof_harder, but the edge labels and claims are
+    split into chunks which are checked by a pool of workers.  Each
+    worker builds its solver for each precision only once, however
+    many chunks it checks.
+    """
+    proof = load_proof(proof)
+    claims = proof_claims(proof)
+    if not tree_ok(claims):
+        return False, 100
+    items = sorted(edge_labels(claims)) + claims
+    n = min(len(items), workers * chunks_per_worker)
+    tasks = [(items[i::n], max_bits) for i in range(n)]
+    pool = multiprocessing.get_context('fork').Pool(
+        workers, initializer=_start_worker, initargs=(proof, None))
+    bits = 100
+    try:
+        for chunk_ans, chunk_bits in pool.imap_unordered(_check_chunk, tasks):
+            if not chunk_ans:
+                return False, chunk_bits
+            bits = max(bits, chunk_bits)
+    finally:
+        pool.terminate()
+        pool.join()
+    return True, bits
+
+def proof_names(archive):
+    """
+    The names of the proofs in a directory or tarball.
+    """
+    if os.path.isdir(archive):
+        return sorted(os.listdir(archive))
+    with tarfile.open(archive, 'r') as tar:
+        return sorted(member.name for member in tar.getmembers()
+                      if member.isfile() and member.name.find('/._') == -1)
+
+def _check_named(task):
+    name, max_bits = task
+    archive = _worker['archive']
+    try:
+        if isinstance(archive, str):
+            proof = binary_proof.load(os.path.join(archive, name))
+        else:
+            proof = load_proof(archive.extractfile(name).read())
+        ans, bits = check_proof_harder(proof, max_bits)
+        return {'name':name, 'valid':ans, 'bits':bits}
+    except Exception as error:
+        return {'name':name, 'valid':False, 'error':repr(error)}
+
+def checked_names(results_file):
+    """
+    The names of the proofs listed in results_file.  A last line cut
+    short, by the run being killed while writing it, is removed.
+    """
+    if not os.path.exists(results_file):
+        return set()
+    with open(results_file, 'rb+') as file:
+        data = file.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            file.truncate(end)
+    return set(json.loads(line)['name'] for line in data[:end].decode('utf-8').splitlines()
+               if line.strip())
+
+def check_proofs(archive, results_file, workers=4, max_bits=1000):
+    """
+    Checks all the proofs, in either format, in the directory or
+    tarball archive with a pool of workers, one proof per worker at a
+    time.  A line of JSON is appended to results_file for each proof
+    as it is checked, and proofs already listed there are skipped, so
+    an interrupted run can be picked up again.  Returns the number of
+    proofs found valid in this run.
+    """
+    done = checked_names(results_file)
+    names = [name for name in proof_names(archive) if name not in done]
+    pool = multiprocessing.get_context('fork').Pool(
+        workers, initializer=_start_worker, initargs=(None, archive))
+    valid = 0
+    try:
+        with open(results_file, 'a') as file:
+            tasks = [(name, max_bits) for name in names]
+            for result in pool.imap_unordered(_check_named, tasks):
+                file.write(json.dumps(result) + '\n')
+                file.flush()
+                valid += result['valid']
+    finally:
+        pool.terminate()
+        pool.join()
+    return valid
+
 if __name__ == '__main__':
-    import doctest
-    results = doctest.testmod()
-    print('check_proof:%s' % (results,))
+    if len(sys.argv) > 2:
+        # check_proof.py archive results_file [workers]
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+        check_proofs(sys.argv[1], sys.argv[2], workers)
+    else:
+        import doctest
+        results = doctest.testmod()
+        print('check_proof:%s' % (results,))
@@ -9,10 +9,11 @@ at the command line::
 
 and you should see::
 
-    word_problem:TestResults(failed=0, attempted=25)
+    word_problem:TestResults(failed=0, attempted=30)
 
 """
 
+import collections
 from snappy import Manifold
 from snappy.snap.interval_reps import contains_one, could_be_equal, diameter
 from snappy.snap.polished_reps import SL2C_inverse
@@ -118,8 +119,32 @@ class WordProblemSolver(object):
     >>> wps = WordProblemSolver(M, bits_prec=100)
     >>> wps.is_trivial(3*R)
     True
+
+    A word can also be given as a list of labels, i.e. subwords, as
+    in a proof.  The matrix of each label is computed once and kept
+    in a cache holding the label_cache_size labels used most
+    recently, so that a word in labels seen before costs one
+    multiplication per label.
+
+    >>> wps.is_trivial_labels(['aab', R, 'BAA'])
+    True
+    >>> wps.is_nontrivial_labels(['aab'])
+    True
+    >>> len(wps.label_cache)
+    3
+
+    The labels are multiplied from left to right, and the product of
+    each prefix is cached too, so that words sharing a prefix, such
+    as those of the leaves below one node of a proof, share the
+    products along it.
+
+    >>> wps.is_trivial_labels(['aab', R, 'BAA', 'aab', R, 'BAA'])
+    True
+    >>> ('aab', R) in wps.product_cache
+    True
     """
-    def __init__(self, manifold, bits_prec=100, fundamental_group_args=[True, True, False]):
+    def __init__(self, manifold, bits_prec=100, fundamental_group_args=[True, True, False],
+                 label_cache_size=10000):
         if not is_manifold(manifold):
             raise ValueError('Sorry, we do not support orbifold singularities')
 
@@ -134,6 +159,9 @@ class WordProblemSolver(object):
             raise WordProblemError("Could not verify the holonomy rep, try increasing precision.")
 
         self.rho = rho
+        self.label_cache = collections.OrderedDict()
+        self.product_cache = collections.OrderedDict()
+        self.label_cache_size = label_cache_size
         self._find_noncommuting_gens()
 
     def _find_noncommuting_gens(self):
@@ -145,8 +173,58 @@ class WordProblemSolver(object):
                 return
         raise WordProblemError("Could not verify a pair of noncommuting gens.")
 
+    def _cached(self, cache, key, compute):
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        X = compute()
+        cache[key] = X
+        if len(cache) > self.label_cache_size:
+            cache.popitem(last=False)
+        return X
+
+    def label_matrix(self, label):
+        """
+        The image of the word label under rho, cached.
+        """
+        return self._cached(self.label_cache, label, lambda : self.rho(label))
+
+    def labels_matrix(self, labels):
+        """
+        The image under rho of the product of the given labels,
+        multiplied from left to right starting from the longest
+        prefix whose product is cached.
+        """
+        n = len(labels)
+        if n == 0:
+            return self.rho('')
+        cache = self.product_cache
+        k = n
+        while k > 1 and tuple(labels[:k]) not in cache:
+            k -= 1
+        if k == 1:
+            X = self.label_matrix(labels[0])
+        else:
+            cache.move_to_end(tuple(labels[:k]))
+            X = cache[tuple(labels[:k])]
+        for i in range(k, n):
+            X = X * self.label_matrix(labels[i])
+            self._cached(cache, tuple(labels[:i + 1]), lambda : X)
+        return X
+
     def is_nontrivial(self, word):
-        X = self.rho(word)
+        return self._is_nontrivial_matrix(self.rho(word))
+
+    def is_trivial(self, word):
+        return not self.is_nontrivial(word)
+
+    def is_nontrivial_labels(self, labels):
+        return self._is_nontrivial_matrix(self.labels_matrix(labels))
+
+    def is_trivial_labels(self, labels):
+        return not self.is_nontrivial_labels(labels)
+
+    def _is_nontrivial_matrix(self, X):
         if not contains_one(X):
             return True
         # Should be trivial, but we need to prove this. The point is
@@ -157,9 +235,6 @@ class WordProblemSolver(object):
         if jorgensens_inequality_fails(X, A) and jorgensens_inequality_fails(X, B):
             return False
         raise WordProblemError('Failed to solve the word problem at this precision.')
-        
-    def is_trivial(self, word):
-        return not self.is_nontrivial(word)
 
 if __name__ == '__main__':
     import doctest
@@ -11,11 +11,18 @@
 import snappy
 import taskdb2.worker
 import quickdisorder
+from quickdisorder.monitor import MetricsCollector
+import os
 
-def printer(depth, string):
-    pass
+# Stop a little before SLURM kills the job, leaving a checkpoint in
+# checkpoint_dir that the next job for the same manifold resumes from.
+max_time = 6.75 * 24 * 3600
+checkpoint_dir = 'checkpoints/'
+metrics_dir = 'metrics/'
 
-quickdisorder.printer = printer
+# Each task retries the search on the grown ball, reusing the group,
+# up to this radius.
+max_radius = 5
 
 def try_to_nonorder(task):
     manifold = snappy.Manifold(task['name'])
@@ -24,12 +31,25 @@ def try_to_nonorder(task):
         radius = 4
     else:
         radius += 1
+    for directory in [checkpoint_dir, metrics_dir]:
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+    checkpoint = checkpoint_dir + task['name'] + '-%d' % radius
+    metrics = MetricsCollector()
     ans = quickdisorder.has_non_orderable_group(manifold, ball_radius = radius, 
-                                           fundamental_group_args = [True, True, False])
+                                           max_ball_radius = max(radius, max_radius),
+                                           fundamental_group_args = [True, True, False],
+                                           max_time=max_time, checkpoint=checkpoint,
+                                           silent=True, monitor=metrics)
+    metrics.write(metrics_dir + task['name'] + '-%d.json' % radius)
+    if ans is None:
+        # Out of time; the checkpoint is picked up by the next run
+        # starting at this radius.
+        return
     if ans:
         task['orderable'] = -1
         task['done'] = True
-    task['cayley_radius'] = radius
+    task['cayley_radius'] = metrics.balls[-1]['radius']
 
 task = {'name':'o9_29674(2, 3)', 'cayley_radius':3}
 taskdb2.worker.run_function('QHSpheres', 'task_disorder', try_to_nonorder)
@@ -11,11 +11,11 @@
 import snappy
 import taskdb2.worker
 import quickdisorder
+from quickdisorder.monitor import MetricsCollector
 
-def printer(depth, string):
-    pass
-
-quickdisorder.printer = printer
+# Each task retries the search on the grown ball, reusing the group,
+# up to this radius.
+max_radius = 5
 
 def try_to_nonorder(task):
     manifold = snappy.Manifold(task['name'])
@@ -24,12 +24,15 @@ def try_to_nonorder(task):
         radius = 4
     else:
         radius += 1
+    metrics = MetricsCollector()
     ans = quickdisorder.has_non_orderable_group(manifold, ball_radius = radius, 
-                                           fundamental_group_args = [True, True, False])
+                                           max_ball_radius = max(radius, max_radius),
+                                           fundamental_group_args = [True, True, False],
+                                           silent=True, monitor=metrics)
     if ans:
         task['orderable'] = -1
         task['done'] = True
-    task['cayley_radius'] = radius
+    task['cayley_radius'] = metrics.balls[-1]['radius']
 
 task = {'name':'o9_29674(2, 3)', 'cayley_radius':3}
 taskdb2.worker.run_function('QHSpheres', 'task_disorder', try_to_nonorder)
@@ -11,9 +11,10 @@
 import snappy
 import taskdb2.worker
 import quickdisorder
-import sys, os, json
+import sys, os
 sys.path.append('../check_proof')
 import check_proof
+import binary_proof
 
 dir = 'proofs/'
 if not os.path.exists(dir):
@@ -22,7 +23,7 @@ if not os.path.exists(dir):
 
 def check_one(task):
     name = task['name']
-    proof = json.loads(open(dir + name, 'r').read())
+    proof = binary_proof.load(dir + name)
     success, bits = check_proof.check_proof_harder(proof)
     if success:
         task['nonord_pf_prec'] = bits
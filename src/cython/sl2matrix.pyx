@@ -1,6 +1,7 @@
 """
 Fast versions of certain heavily called functions.
 """
+from array import array
 cdef extern from "matrix.h":
     ctypedef struct GL2CMatrix:
         double real[2][2]
@@ -36,14 +37,21 @@ cdef GL2CMatrix_to_array(GL2CMatrix* M):
     return ans
 
 cdef class DoubleGroupElement(object):
+    """
+    The word of an element made by __mul__ or inverse is not built
+    until it is asked for.  Until then, _word is None and _parts holds
+    either the two factors or the element inverted, whose words are
+    combined on demand by flatten_word.
+    """
     cdef GL2CMatrix matrix
     cdef int min_bits_accuracy
-    cpdef readonly word
+    cdef object _word
+    cdef tuple _parts
     cdef long[8] _hashed_matrix
     cdef _hash
     
     def __cinit__(self, matrix, min_bits_accuracy, word=''):
-        self.min_bits_accuracy, self.word = min_bits_accuracy, word
+        self.min_bits_accuracy, self._word = min_bits_accuracy, word
         if matrix is not None: 
             copy_to_GL2CMatrix(matrix, &self.matrix)
             self.set_hash()
@@ -59,8 +67,8 @@ cdef class DoubleGroupElement(object):
 
     def __mul__(DoubleGroupElement self, DoubleGroupElement other):
         cdef DoubleGroupElement ans
-        ans = DoubleGroupElement(None, self.min_bits_accuracy,
-                                self.word + other.word)
+        ans = DoubleGroupElement(None, self.min_bits_accuracy, None)
+        ans._parts = (self, other)
         multiply_GL2C(&self.matrix, &other.matrix, &ans.matrix)
         ans.set_hash()
         return ans
@@ -107,14 +115,36 @@ cdef class DoubleGroupElement(object):
 
     def inverse(self):
         cdef DoubleGroupElement ans
-        ans = DoubleGroupElement(None, self.min_bits_accuracy,
-                                 self.word.swapcase()[::-1])
+        ans = DoubleGroupElement(None, self.min_bits_accuracy, None)
+        ans._parts = (self,)
         inverse_SL2C(&self.matrix, &ans.matrix)
         ans.set_hash()
         return ans
 
+    @property
+    def word(self):
+        if self._word is None:
+            self._word = flatten_word(self)
+            self._parts = None
+        return self._word
+
     def _set_word(self, word):
-        self.word = word
+        self._word, self._parts = word, None
+
+    def key(self):
+        """
+        The quantized matrix entries used for hashing and comparison.
+        """
+        cdef long *h = self._hashed_matrix
+        return (h[0], h[1], h[2], h[3], h[4], h[5], h[6], h[7])
+
+    def nearby_keys(self, double slop):
+        """
+        The keys of the cells adjacent to that of self across the cell
+        boundaries which self is within slop (a fraction of the cell
+        size) of.
+        """
+        return nearby_keys_of(&self.matrix, self.min_bits_accuracy, slop)
     
     def __repr__(self):
         A = GL2CMatrix_to_array(&self.matrix)
@@ -122,6 +152,27 @@ cdef class DoubleGroupElement(object):
         args = tuple([self.word] + entries)
         return "<NGE: %s; %r %r %r %r>" % args
 
+cdef flatten_word(DoubleGroupElement element):
+    """
+    Builds the word of an element from the words of the elements it
+    was made from, without recursion so that long chains of products
+    are fine.
+    """
+    cdef DoubleGroupElement x
+    cdef bint inverted
+    chunks, stack = [], [(element, False)]
+    while stack:
+        x, inverted = stack.pop()
+        if x._word is not None:
+            chunks.append(x._word.swapcase()[::-1] if inverted else x._word)
+        elif len(x._parts) == 1:
+            stack.append((x._parts[0], not inverted))
+        elif inverted:
+            stack += [(x._parts[0], True), (x._parts[1], True)]
+        else:
+            stack += [(x._parts[1], False), (x._parts[0], False)]
+    return ''.join(chunks)
+
 cdef class ProjectiveDoubleGroupElement(DoubleGroupElement):
     def __cmp__(DoubleGroupElement self, DoubleGroupElement other):
         cdef int i
@@ -146,3 +197,279 @@ cdef class ProjectiveDoubleGroupElement(DoubleGroupElement):
             return 0
         else:
             return result
+
+
+# Flat arrays of matrices: each GL2CMatrix is stored as 8 consecutive
+# doubles, namely its real parts followed by its imaginary parts.
+
+cdef inline GL2CMatrix* matrix_at(const double[:] A, Py_ssize_t i):
+    # The arrays may be read-only memory maps; the matrix returned is
+    # only ever written to when A is a writable array.
+    return <GL2CMatrix*>&A[8*i]
+
+cdef key_of(GL2CMatrix* M, int bits):
+    cdef long h[8]
+    hash_GL2C(M, h, bits)
+    return (h[0], h[1], h[2], h[3], h[4], h[5], h[6], h[7])
+
+cdef int boundary_cells(GL2CMatrix* M, int bits, double slop,
+                        long* key, int* coords, long* other):
+    """
+    Sets key to the key of M, as computed by hash_GL2C.  For each of
+    the 8 coordinates which is within slop of the boundary of its
+    cell, records the coordinate in coords and the key of the
+    neighboring cell in other.  Returns the number of such
+    coordinates.
+    """
+    cdef double N = 1 << bits
+    cdef double v
+    cdef long lo, hi
+    cdef int i, j, c, m = 0
+    for i in range(2):
+        for j in range(2):
+            for c in range(2):
+                v = N*M.real[i][j] if c == 0 else N*M.imag[i][j]
+                key[4*i + 2*j + c] = <long>v
+                lo, hi = <long>(v - slop), <long>(v + slop)
+                if lo != key[4*i + 2*j + c]:
+                    coords[m], other[m] = 4*i + 2*j + c, lo
+                    m += 1
+                elif hi != key[4*i + 2*j + c]:
+                    coords[m], other[m] = 4*i + 2*j + c, hi
+                    m += 1
+    return m
+
+cdef nearby_keys_of(GL2CMatrix* M, int bits, double slop):
+    cdef long key[8]
+    cdef long alt[8]
+    cdef int coords[8]
+    cdef long other[8]
+    cdef int m, mask, k
+    m = boundary_cells(M, bits, slop, key, coords, other)
+    ans = []
+    for mask in range(1, 1 << m):
+        for k in range(8):
+            alt[k] = key[k]
+        for k in range(m):
+            if mask & (1 << k):
+                alt[coords[k]] = other[k]
+        ans.append((alt[0], alt[1], alt[2], alt[3], alt[4], alt[5], alt[6], alt[7]))
+    return ans
+
+def nearby_keys(const double[:] A, Py_ssize_t i, int bits, double slop, inverse=False):
+    """
+    The keys of the cells near that of matrix i of A (or of its
+    inverse), as in DoubleGroupElement.nearby_keys.
+    """
+    cdef GL2CMatrix M
+    if inverse:
+        inverse_SL2C(matrix_at(A, i), &M)
+        return nearby_keys_of(&M, bits, slop)
+    return nearby_keys_of(matrix_at(A, i), bits, slop)
+
+def zero_matrices(Py_ssize_t n):
+    return array('d', [0.0]) * (8*n)
+
+def pack_matrices(elements):
+    """
+    Flat array of the matrices of the given DoubleGroupElements.
+    """
+    cdef DoubleGroupElement e
+    cdef Py_ssize_t i = 0
+    ans = zero_matrices(len(elements))
+    cdef double[:] A = ans
+    for e in elements:
+        copy_GL2C(&e.matrix, matrix_at(A, i))
+        i += 1
+    return ans
+
+def multiply_many(const double[:] A, const int[:] left, const double[:] B,
+                  const int[:] right, double[:] C):
+    """
+    Sets matrix k of C to the product of matrix left[k] of A and
+    matrix right[k] of B.
+    """
+    cdef Py_ssize_t k
+    for k in range(left.shape[0]):
+        multiply_GL2C(matrix_at(A, left[k]), matrix_at(B, right[k]), matrix_at(C, k))
+
+def matrix_keys(const double[:] A, int bits, Py_ssize_t start=0, Py_ssize_t stop=-1):
+    """
+    The keys, as in DoubleGroupElement.key, of the matrices in A in
+    positions start through stop - 1, and of their inverses.
+    """
+    cdef GL2CMatrix inverse
+    cdef Py_ssize_t i
+    if stop < 0:
+        stop = A.shape[0] // 8
+    keys, inverse_keys = [], []
+    for i in range(start, stop):
+        keys.append(key_of(matrix_at(A, i), bits))
+        inverse_SL2C(matrix_at(A, i), &inverse)
+        inverse_keys.append(key_of(&inverse, bits))
+    return keys, inverse_keys
+
+def product_key(const double[:] A, Py_ssize_t i, Py_ssize_t j, int bits):
+    """
+    The key of the product of matrices i and j of A.
+    """
+    cdef GL2CMatrix C
+    multiply_GL2C(matrix_at(A, i), matrix_at(A, j), &C)
+    return key_of(&C, bits)
+
+def is_one_at(const double[:] A, Py_ssize_t i, int bits):
+    return bool(is_one(matrix_at(A, i), bits))
+
+def element_at(const double[:] A, Py_ssize_t i, int min_bits_accuracy, word):
+    """
+    The DoubleGroupElement with matrix i of A.
+    """
+    cdef DoubleGroupElement ans
+    ans = DoubleGroupElement(None, min_bits_accuracy, word)
+    copy_GL2C(matrix_at(A, i), &ans.matrix)
+    ans.set_hash()
+    return ans
+
+
+# A read-only hash table from keys to ids, stored in two flat arrays so
+# that it can live in a shared memory map: keys holds the 8 entries of
+# the key of each id as 64 bit integers on every platform, and slots is
+# an open addressing table of ids (or -1) whose length is a power of 2.
+
+cdef unsigned long long key_hash(const long* key):
+    cdef unsigned long long h = 14695981039346656037ULL
+    cdef int i
+    for i in range(8):
+        h = (h ^ <unsigned long long>key[i]) * 1099511628211ULL
+    return h
+
+cdef Py_ssize_t find_key(const long long[:] keys, const int[:] slots, const long* key):
+    cdef Py_ssize_t mask = slots.shape[0] - 1
+    cdef Py_ssize_t s = key_hash(key) & mask
+    cdef Py_ssize_t i
+    cdef int j
+    while True:
+        i = slots[s]
+        if i == -1:
+            return -1
+        for j in range(8):
+            if keys[8*i + j] != key[j]:
+                break
+        else:
+            return i
+        s = (s + 1) & mask
+
+def build_key_table(const long long[:] keys, int[:] slots):
+    """
+    Fills slots with the ids whose keys are given.  The length of
+    slots must be a power of 2 larger than the number of keys.
+    """
+    cdef Py_ssize_t mask = slots.shape[0] - 1
+    cdef Py_ssize_t i, s
+    cdef long k[8]
+    cdef int j
+    for s in range(slots.shape[0]):
+        slots[s] = -1
+    for i in range(keys.shape[0] // 8):
+        for j in range(8):
+            k[j] = keys[8*i + j]
+        s = key_hash(k) & mask
+        while slots[s] != -1:
+            s = (s + 1) & mask
+        slots[s] = i
+
+def lookup_key(const long long[:] keys, const int[:] slots, key):
+    """
+    The id of the given key, or -1 if it is not in the table.
+    """
+    cdef long k[8]
+    cdef int j
+    for j in range(8):
+        k[j] = key[j]
+    return find_key(keys, slots, k)
+
+cdef Py_ssize_t find_matrix(GL2CMatrix* C, int bits, const long long[:] keys,
+                            const int[:] slots, double slop, list stats):
+    """
+    The id in the given table of the matrix C, or -1 if it is not
+    there.  If the key of C is not in the table but C is within slop
+    of the boundary of its cell, the neighboring cells are tried too.
+    Such lookups are counted in stats[0], and those that succeed in
+    stats[1].
+    """
+    cdef long key[8]
+    cdef int coords[8]
+    cdef long other[8]
+    cdef int m, mask, k
+    cdef Py_ssize_t ans
+    m = boundary_cells(C, bits, slop, key, coords, other)
+    ans = find_key(keys, slots, key)
+    if ans != -1 or m == 0:
+        return ans
+    stats[0] += 1
+    for mask in range(1, 1 << m):
+        for k in range(m):
+            if mask & (1 << k):
+                key[coords[k]], other[k] = other[k], key[coords[k]]
+        ans = find_key(keys, slots, key)
+        for k in range(m):
+            if mask & (1 << k):
+                key[coords[k]], other[k] = other[k], key[coords[k]]
+        if ans != -1:
+            stats[1] += 1
+            return ans
+    return -1
+
+def product_row(const double[:] A, const int[:] positions, Py_ssize_t i, int side,
+                int bits, const long long[:] keys, const int[:] slots, double slop, list stats):
+    """
+    Multiplies the element with id i by every element of the table,
+    on the right if side is 0 and on the left if side is 1, where the
+    matrix of the element with id j is at positions[j] in A.  Returns
+    arrays of the ids j for which the product is in the table and of
+    the ids of those products.
+    """
+    cdef GL2CMatrix C
+    cdef GL2CMatrix* M = matrix_at(A, positions[i])
+    cdef Py_ssize_t j, k
+    others, products = array('i'), array('i')
+    for j in range(positions.shape[0]):
+        if side == 0:
+            multiply_GL2C(M, matrix_at(A, positions[j]), &C)
+        else:
+            multiply_GL2C(matrix_at(A, positions[j]), M, &C)
+        k = find_matrix(&C, bits, keys, slots, slop, stats)
+        if k != -1:
+            others.append(j)
+            products.append(k)
+    return others, products
+
+def conjugation_row(const double[:] A, const int[:] positions, Py_ssize_t i, int side,
+                    int bits, const long long[:] keys, const int[:] slots, double slop,
+                    list stats):
+    """
+    Conjugates the element y with id i by every element g of the
+    table, as g y g^-1 if side is 0 and as g^-1 y g if side is 1,
+    where the matrix of the element with id j is at positions[j] in
+    A.  Returns arrays of the ids of the g for which the conjugate is
+    in the table and of the ids of those conjugates.
+    """
+    cdef GL2CMatrix C, D, G_inverse
+    cdef GL2CMatrix* Y = matrix_at(A, positions[i])
+    cdef GL2CMatrix* G
+    cdef Py_ssize_t j, k
+    conjugators, conjugates = array('i'), array('i')
+    for j in range(positions.shape[0]):
+        G = matrix_at(A, positions[j])
+        inverse_SL2C(G, &G_inverse)
+        if side == 0:
+            multiply_GL2C(G, Y, &C)
+            multiply_GL2C(&C, &G_inverse, &D)
+        else:
+            multiply_GL2C(&G_inverse, Y, &C)
+            multiply_GL2C(&C, G, &D)
+        k = find_matrix(&D, bits, keys, slots, slop, stats)
+        if k != -1:
+            conjugators.append(j)
+            conjugates.append(k)
+    return conjugators, conjugates
@@ -1,3 +1,16 @@
+import bisect
+from array import array
+from . import sl2matrix, flatfile
+
+# Marker for elements and products that are not in the ball.
+OUTSIDE = -1
+
+# Elements are identified by quantizing their matrix entries, so two
+# computations of the same element can land in adjacent cells when an
+# entry is very close to a cell boundary.  When a key is not found, the
+# neighboring cells across any boundary within this fraction of a cell
+# are tried as well.
+boundary_slop = 2.0**-10
 
 def inverse_word(word):
     return word.swapcase()[::-1]
@@ -19,33 +32,567 @@ def ball_in_free_group(gens,  length):
         curr = new_words
     return ans
 
+class WordList(object):
+    """
+    The words of a ball stored in a file: text holds the words
+    separated by newlines, and word p starts at offsets[p].
+    """
+    def __init__(self, text, offsets):
+        self.text, self.offsets = text, offsets
+
+    def __getitem__(self, p):
+        if p < 0:
+            p += len(self)
+        start, end = self.offsets[p], self.offsets[p + 1] - 1
+        return self.text[start:end].tobytes().decode('ascii')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return iter(self.text.tobytes().decode('ascii').split('\n'))
+
+class PairList(object):
+    """
+    A sequence of pairs stored in a flat array.
+    """
+    def __init__(self, flat):
+        self.flat = flat
+
+    def __getitem__(self, k):
+        return self.flat[2*k], self.flat[2*k + 1]
+
+    def __len__(self):
+        return len(self.flat) // 2
+
+    def __iter__(self):
+        return zip(self.flat[0::2], self.flat[1::2])
+
+class KeyTable(object):
+    """
+    A read-only dictionary from matrix keys to ids, stored in flat
+    arrays as described in sl2matrix.build_key_table.
+    """
+    def __init__(self, keys, slots):
+        self.keys, self.slots = keys, slots
+
+    def get(self, key, default=None):
+        i = sl2matrix.lookup_key(self.keys, self.slots, key)
+        return default if i < 0 else i
+
+    def __getitem__(self, key):
+        i = sl2matrix.lookup_key(self.keys, self.slots, key)
+        if i < 0:
+            raise KeyError(key)
+        return i
+
+    def __len__(self):
+        return len(self.keys) // 8
+
+    def items(self):
+        keys = self.keys.tolist()
+        return [(tuple(keys[8*i:8*i + 8]), i) for i in range(len(self))]
+
 class CayleyBall(object):
     """
     Ball about 1 in the Cayley graph of a group.
+
+    The ball is built one level at a time: the matrices for the words
+    of length n are computed in a single batch from those of length
+    n - 1 and the generators, and stored in the flat array
+    self.matrices.  Element objects are only created when asked for.
+
+    Each distinct element of the ball is assigned a dense integer id.
+    The search works with whole rows of products of an element with
+    the rest of the ball, from neighbors and conjugates, and these
+    rows are the ball's only multiplication table.  Single products
+    of ids are looked up in them by product.
+
+    >>> import snappy, quickdisorder
+    >>> G = quickdisorder.Double3ManifoldGroup(snappy.Manifold('m004(1,2)'))
+    >>> B = G.ball(2)
+    >>> len(B.id_elements) == len(B)
+    True
+    >>> a, A = B.id_of(G('a')), B.id_of(G('A'))
+    >>> B.inverse_ids[a] == A
+    True
+    >>> B.product(a, A) in B.one_ids
+    True
+    >>> B.product(a, B.id_of(G('ab'))) == OUTSIDE
+    True
+    >>> B.element(a).word
+    'a'
+
+    Lookups which had to try a neighboring cell are counted, as are
+    those that found the element there:
+
+    >>> sorted(B.boundary_statistics())
+    ['near_boundary', 'rescued']
     """
     def __init__(self, group, radius):
-        all_words = ball_in_free_group(group.rho.generators(), radius)
-        ordered_elements = [group(w) for w in all_words]
-        elements = set(ordered_elements)
+        self._set_group(group)
+        letters = self.letters
+        self.words = [''] + letters
+        self.matrices = sl2matrix.pack_matrices([group('')]) + self.generator_matrices
+        self.last_letters = [-1] + list(range(len(letters)))
+        # The words of maximal length, before any renaming done when
+        # pairing up inverses.
+        self._last_level = (1, list(letters))
+        self.radius = 1
+
+        self.index, self.id_positions, self.position_ids = dict(), [], array('i')
+        self.inverse_ids, self.one_ids = [], frozenset()
+        self.pair_positions, self.id_pairs = [], []
+        self._seen_one = dict()
+        self._elements_at = dict()
+        self._ordered_elements = None
+        self.boundary_stats = [0, 0]
+        self._table, self._neighbors = None, [dict(), dict()]
+        self._conjugates = [dict(), dict()]
+        self.shared = False
+        while self.radius < radius:
+            self._add_level()
+            self.radius += 1
+        self._index_elements(0)
+
+    def _set_group(self, group):
+        self.min_bits_accuracy = group.min_bits_accuracy
+        gens = group.generators()
+        letters = gens + [g.swapcase() for g in gens]
+        self.letters = letters
+        self.next_letters = [[letters.index(h) for h in hs]
+                             for g, hs in sorted(next_gen_dict(gens).items(),
+                                                 key=lambda x:letters.index(x[0]))]
+        self.generator_matrices = sl2matrix.pack_matrices([group(g) for g in letters])
+
+    def save(self, path):
+        """
+        Writes the ball to the given file in the format of
+        quickdisorder.flatfile; see CayleyBall.load.
+        """
+        keys, slots, positions = self._key_table()
+        text = '\n'.join(self.words).encode('ascii')
+        offsets, offset = array('q'), 0
+        for word in self.words:
+            offsets.append(offset)
+            offset += len(word) + 1
+        offsets.append(offset)
+        meta = {'radius':self.radius,
+                'min_bits_accuracy':self.min_bits_accuracy,
+                'letters':self.letters,
+                'last_level_start':self._last_level[0]}
+        arrays = {'generator_matrices':self.generator_matrices,
+                  'matrices':self.matrices,
+                  'words':array('B', text),
+                  'word_offsets':offsets,
+                  'last_letters':array('b', self.last_letters),
+                  'keys':keys,
+                  'key_slots':slots,
+                  'position_ids':array('i', self.position_ids),
+                  'id_positions':array('i', self.id_positions),
+                  'inverse_ids':array('i', self.inverse_ids),
+                  'one_ids':array('i', sorted(self.one_ids)),
+                  'pair_positions':array('i', [p for pair in self.pair_positions for p in pair]),
+                  'id_pairs':array('i', [i for pair in self.id_pairs for i in pair])}
+        flatfile.save(path, meta, arrays)
+
+    @classmethod
+    def load(cls, group, path, shared=False):
+        """
+        Reads a ball written by CayleyBall.save for the given group.
+
+        >>> import snappy, quickdisorder, tempfile, os
+        >>> G = quickdisorder.Double3ManifoldGroup(snappy.Manifold('m004(1,2)'))
+        >>> B = G.ball(3)
+        >>> path = os.path.join(tempfile.mkdtemp(), 'ball')
+        >>> B.save(path)
+        >>> C = CayleyBall.load(G, path)
+        >>> C.words == B.words and C.id_pairs == B.id_pairs and C.index == B.index
+        True
+        >>> C.grow(4)
+        >>> C.words == G.ball(4).words
+        True
+
+        If shared is True, the arrays of the ball are used in place
+        from a read-only memory map of the file, so all processes on
+        a machine which load the same file share a single copy.  Only
+        the rows of products are private to each process.  Growing a
+        shared ball first makes a private copy of it.
+
+        >>> S = CayleyBall.load(G, path, shared=True)
+        >>> S.shared, len(S) == len(B), S.words[-1] == B.words[-1]
+        (True, True, True)
+        >>> a, b = S.id_of(G('a')), S.id_of(G('b'))
+        >>> S.element(S.product(a, b)).key() == G('ab').key()
+        True
+        >>> list(S.id_pairs) == B.id_pairs
+        True
+        >>> S.grow(4)
+        >>> S.shared, S.words == G.ball(4).words
+        (False, True)
+        """
+        meta, arrays = flatfile.load(path)
+        if arrays['keys'].format != 'q' or arrays['word_offsets'].format != 'q':
+            raise ValueError('The ball in %s was saved in an older format' % path)
+        B = cls.__new__(cls)
+        B._set_group(group)
+        if meta['letters'] != B.letters or meta['min_bits_accuracy'] != B.min_bits_accuracy:
+            raise ValueError('The ball in %s is for a different group' % path)
+        B.radius = meta['radius']
+        B.generator_matrices = flatfile.to_array(arrays['generator_matrices'])
+        B.matrices = arrays['matrices']
+        B.words = WordList(arrays['words'], arrays['word_offsets'])
+        B.last_letters = arrays['last_letters']
+        B._last_level = (meta['last_level_start'], None)
+        B.index = KeyTable(arrays['keys'], arrays['key_slots'])
+        B.position_ids = arrays['position_ids']
+        B.id_positions = arrays['id_positions']
+        B.inverse_ids = arrays['inverse_ids']
+        B.one_ids = frozenset(arrays['one_ids'].tolist())
+        B.pair_positions = PairList(arrays['pair_positions'])
+        B.id_pairs = PairList(arrays['id_pairs'])
+        B._seen_one = None
+        B._elements_at = dict()
+        B._ordered_elements = None
+        B.boundary_stats = [0, 0]
+        B._neighbors, B._conjugates = [dict(), dict()], [dict(), dict()]
+        B._table = (B.index.keys, B.index.slots, B.id_positions)
+        B.shared = True
+        if not shared:
+            B._unshare()
+        return B
+
+    def _unshare(self):
+        """
+        Replaces the memory mapped arrays of a shared ball with private
+        copies which can be extended.
+        """
+        self.matrices = flatfile.to_array(self.matrices)
+        self.words = list(self.words)
+        self.last_letters = self.last_letters.tolist()
+        self.index = dict(self.index.items())
+        self.position_ids = flatfile.to_array(self.position_ids)
+        self.id_positions = self.id_positions.tolist()
+        self.inverse_ids = self.inverse_ids.tolist()
+        self.pair_positions = list(self.pair_positions)
+        self.id_pairs = list(self.id_pairs)
+        self._table = None
+        self.shared = False
+
+    def _key_table(self):
+        """
+        The keys of the elements, ordered by id, the slots of a hash
+        table for them as in sl2matrix.build_key_table, and the
+        positions of the elements as an array.
+        """
+        if self._table is None:
+            n = len(self.id_positions)
+            keys = [None]*n
+            for key, i in self.index.items():
+                keys[i] = key
+            keys = array('q', [x for key in keys for x in key])
+            slots = array('i', [0]) * (1 << (2*n).bit_length())
+            sl2matrix.build_key_table(keys, slots)
+            self._table = (keys, slots, array('i', self.id_positions))
+        return self._table
+
+    def grow(self, radius):
+        """
+        Extends the ball in place to the given radius.  Existing ids,
+        pairs and products stay valid, except that products which were
+        outside the smaller ball are recomputed when next needed, and
+        elements already in the ball keep their representative word.
+
+        >>> import snappy, quickdisorder
+        >>> G = quickdisorder.Double3ManifoldGroup(snappy.Manifold('m004(1,2)'))
+        >>> B, C = G.ball(2), G.ball(3)
+        >>> B.grow(3)
+        >>> B.words == C.words and B.id_pairs == C.id_pairs
+        True
+        >>> B.product(B.id_of(G('a')), B.id_of(G('ab'))) == B.id_of(G('aab'))
+        True
+        """
+        if self.shared and self.radius < radius:
+            self._unshare()
+        start = len(self.words)
+        while self.radius < radius:
+            self._add_level()
+            self.radius += 1
+        if start < len(self.words):
+            self._index_elements(start)
+
+    def _add_level(self):
+        """
+        Adds all reduced words obtained by extending the words of
+        maximal length by one letter.
+        """
+        start, level_words = self._last_level
+        if level_words is None:
+            gens = self.letters[:len(self.letters)//2]
+            level_words = ball_in_free_group(gens, self.radius)[start:]
+        parents, new_letters, new_words = array('i'), array('i'), []
+        letters = self.letters
+        for p, word in enumerate(level_words, start):
+            for l in self.next_letters[self.last_letters[p]]:
+                parents.append(p)
+                new_letters.append(l)
+                new_words.append(word + letters[l])
+        new_matrices = sl2matrix.zero_matrices(len(new_words))
+        sl2matrix.multiply_many(self.matrices, parents, self.generator_matrices,
+                                new_letters, new_matrices)
+        self._last_level = (len(self.words), new_words)
+        self.matrices += new_matrices
+        self.words += new_words
+        self.last_letters += new_letters
+
+    def _index_elements(self, start):
+        """
+        Number the distinct elements given by the words from position
+        start on, in the order they first appear in self.words, and
+        find the {g, g^-1} pairs among them.  The position stored for
+        each new id is that of its last word, so all arithmetic on ids
+        is done with the same representative.
+        """
+        bits, words, matrices = self.min_bits_accuracy, self.words, self.matrices
+        keys, inverse_keys = sl2matrix.matrix_keys(matrices, bits, start)
+        index, id_positions, position_ids = self.index, self.id_positions, self.position_ids
+        first_id = len(id_positions)
+        for p, key in enumerate(keys, start):
+            i = index.get(key)
+            if i is None:
+                i = self._find_nearby(
+                    sl2matrix.nearby_keys(matrices, p, bits, boundary_slop))
+            if i == OUTSIDE:
+                i = index[key] = len(id_positions)
+                id_positions.append(p)
+            elif i >= first_id:
+                id_positions[i] = p
+            position_ids.append(i)
+
+        inverse_position_ids = []
+        for p, h in enumerate(inverse_keys, start):
+            j = index.get(h, OUTSIDE)
+            if j == OUTSIDE:
+                j = self._find_nearby(
+                    sl2matrix.nearby_keys(matrices, p, bits, boundary_slop, inverse=True))
+            inverse_position_ids.append(j)
+
         # Create the list of {g, g^-1} pairs
-        seen_one = dict()
-        non_id_element_pairs = []
-        for g in ordered_elements:
-            h = g.inverse()
-            if h in seen_one:
-                h = seen_one[h]
+        if self._seen_one is None:
+            self._rebuild_seen_one(start)
+        seen_one = self._seen_one
+        for p in range(start, len(words)):
+            j = inverse_position_ids[p - start]
+            if j in seen_one:
+                q = seen_one[j]
                 # Want the words associated to g and h be inverses in
                 # the free group.
-                if h.word != inverse_word(g.word):
-                    g._set_word(inverse_word(h.word))
-                non_id_element_pairs.append( (seen_one[h], g) )
+                if words[q] != inverse_word(words[p]):
+                    words[p] = inverse_word(words[q])
+                self.pair_positions.append( (q, p) )
+                self.id_pairs.append( (position_ids[q], position_ids[p]) )
             else:
-                seen_one[g] = g
+                seen_one[position_ids[p]] = p
+
+        # Inverses which were missing from the smaller ball may be
+        # present now.
+        for i, j in enumerate(self.inverse_ids):
+            if j == OUTSIDE:
+                p = id_positions[i]
+                h = sl2matrix.matrix_keys(matrices, bits, p, p + 1)[1][0]
+                j = index.get(h, OUTSIDE)
+                if j == OUTSIDE:
+                    j = self._find_nearby(
+                        sl2matrix.nearby_keys(matrices, p, bits, boundary_slop, inverse=True))
+                self.inverse_ids[i] = j
+        for p in id_positions[first_id:]:
+            self.inverse_ids.append(inverse_position_ids[p - start])
+        self.one_ids = self.one_ids | frozenset(
+            i for i, p in enumerate(id_positions[first_id:], first_id)
+            if sl2matrix.is_one_at(matrices, p, bits))
+
+        self._ordered_elements = None
+        self._table, self._neighbors = None, [dict(), dict()]
+        self._conjugates = [dict(), dict()]
+
+    def _rebuild_seen_one(self, stop):
+        """
+        Recovers the state of the pairing of inverses after the first
+        stop words, for a ball which was loaded from a file.
+        """
+        paired = set(p for q, p in self.pair_positions)
+        self._seen_one = dict((self.position_ids[p], p)
+                              for p in range(stop) if p not in paired)
+
+    def _find_nearby(self, keys):
+        """
+        The id of the first of the given keys of neighboring cells
+        which is in the ball, or OUTSIDE.
+        """
+        if not keys:
+            return OUTSIDE
+        self.boundary_stats[0] += 1
+        for key in keys:
+            i = self.index.get(key, OUTSIDE)
+            if i != OUTSIDE:
+                self.boundary_stats[1] += 1
+                return i
+        return OUTSIDE
+
+    def boundary_statistics(self):
+        """
+        The number of lookups which missed but were near the boundary
+        of a cell, and how many of those found the element in a
+        neighboring cell.
+        """
+        return {'near_boundary':self.boundary_stats[0],
+                'rescued':self.boundary_stats[1]}
+
+    def element_at(self, p):
+        """
+        The element given by the word in position p.
+        """
+        e = self._elements_at.get(p)
+        if e is None:
+            e = sl2matrix.element_at(self.matrices, p, self.min_bits_accuracy, self.words[p])
+            self._elements_at[p] = e
+        return e
+
+    def element(self, i):
+        """
+        The element with id i.
+        """
+        return self.element_at(self.id_positions[i])
+
+    def pair_element(self, k, side):
+        """
+        The element on the given side (0 or 1) of the k-th pair.
+        """
+        return self.element_at(self.pair_positions[k][side])
+
+    def id_of(self, element):
+        """
+        The id of the given element, or OUTSIDE if it is not in the ball.
+        """
+        i = self.index.get(element.key(), OUTSIDE)
+        if i == OUTSIDE:
+            i = self._find_nearby(element.nearby_keys(boundary_slop))
+        return i
+
+    def product(self, i, j):
+        """
+        The id of the product of the elements with ids i and j, or
+        OUTSIDE if the product is not in the ball, as found in the row
+        neighbors(i, 0).
+        """
+        others, products = self.neighbors(i, 0)
+        k = bisect.bisect_left(others, j)
+        if k < len(others) and others[k] == j:
+            return products[k]
+        return OUTSIDE
+
+    def neighbors(self, i, side):
+        """
+        The elements which the element with id i can be multiplied by,
+        on the right if side is 0 and on the left if side is 1,
+        without leaving the ball.  Returned as two arrays: the ids j
+        of those elements and the ids of the products.  Each list is
+        computed in one pass when first needed, and thrown away when
+        the ball grows.
+
+        >>> import snappy, quickdisorder
+        >>> G = quickdisorder.Double3ManifoldGroup(snappy.Manifold('m004(1,2)'))
+        >>> B = G.ball(3)
+        >>> a, b = B.id_of(G('a')), B.id_of(G('b'))
+        >>> others, products = B.neighbors(a, 0)
+        >>> products[list(others).index(b)] == B.id_of(G('ab'))
+        True
+        >>> others, products = B.neighbors(a, 1)
+        >>> products[list(others).index(b)] == B.id_of(G('ba'))
+        True
+        >>> all(B.product(j, a) == k for j, k in zip(others, products))
+        True
+        """
+        row = self._neighbors[side].get(i)
+        if row is None:
+            keys, slots, positions = self._key_table()
+            row = sl2matrix.product_row(self.matrices, positions, i, side,
+                                        self.min_bits_accuracy, keys, slots,
+                                        boundary_slop, self.boundary_stats)
+            self._neighbors[side][i] = row
+        return row
+
+    def conjugates(self, i, side):
+        """
+        The conjugates of the element y with id i which are in the
+        ball, namely g y g^-1 if side is 0 and g^-1 y g if side is 1,
+        as two arrays: the ids of the g and the ids of the
+        conjugates.  Like neighbors, each list is computed in one pass
+        when first needed.
+
+        >>> import snappy, quickdisorder
+        >>> G = quickdisorder.Double3ManifoldGroup(snappy.Manifold('m004(1,2)'))
+        >>> B = G.ball(3)
+        >>> a, b = B.id_of(G('a')), B.id_of(G('b'))
+        >>> conjugators, conjugates = B.conjugates(a, 0)
+        >>> conjugates[list(conjugators).index(b)] == B.id_of(G('baB'))
+        True
+        >>> conjugators, conjugates = B.conjugates(a, 1)
+        >>> conjugates[list(conjugators).index(b)] == B.id_of(G('Bab'))
+        True
+        """
+        row = self._conjugates[side].get(i)
+        if row is None:
+            keys, slots, positions = self._key_table()
+            row = sl2matrix.conjugation_row(self.matrices, positions, i, side,
+                                            self.min_bits_accuracy, keys, slots,
+                                            boundary_slop, self.boundary_stats)
+            self._conjugates[side][i] = row
+        return row
+
+    def products_computed(self):
+        """
+        The number of products evaluated so far, by neighbors and
+        conjugates.
+        """
+        rows = len(self._neighbors[0]) + len(self._neighbors[1])
+        rows += 2 * (len(self._conjugates[0]) + len(self._conjugates[1]))
+        return rows * len(self)
+
+    def products_in_ball(self):
+        """
+        How many of the products counted by products_computed landed
+        in the ball.  Each conjugate is counted once.
+        """
+        ans = 0
+        for rows in self._neighbors + self._conjugates:
+            ans += sum(len(others) for others, products in rows.values())
+        return ans
+
+    # The attributes below create an element object for every word in
+    # the ball, so the search itself avoids them.
+
+    @property
+    def ordered_elements(self):
+        if self._ordered_elements is None:
+            self._ordered_elements = [self.element_at(p) for p in range(len(self.words))]
+        return self._ordered_elements
+
+    @property
+    def elements(self):
+        return set(self.ordered_elements)
+
+    @property
+    def element_dict(self):
+        return {e:e for e in self.ordered_elements}
+
+    @property
+    def id_elements(self):
+        return [self.element(i) for i in range(len(self.id_positions))]
 
-        self.ordered_elements = ordered_elements
-        self.elements = elements
-        self.non_id_element_pairs = non_id_element_pairs
-        self.element_dict = {e:e for e in ordered_elements}
+    @property
+    def non_id_element_pairs(self):
+        return [(self.element_at(q), self.element_at(p)) for q, p in self.pair_positions]
 
     def __len__(self):
-        return len(self.elements)
+        return len(self.id_positions)
@@ -0,0 +1,210 @@
+"""
+Benchmarks for the hot paths of the nonorderability search.
+
+For each manifold and ball radius in a panel, the following stages
+are timed:
+
+    ball              building the CayleyBall
+    saturate          saturating the first three monoids of the search
+    saturate_biorder  the same with biorder=True
+    search            a full run of has_non_orderable_group
+    check_proof       checking the proof found, which needs Sage
+
+Each stage reports its wall time, the peak memory allocated by Python
+while it ran, and the number of products of ball elements evaluated.
+The results are written as JSON, so two runs can be compared with
+--compare::
+
+    python -m quickdisorder.benchmark --output new.json --compare old.json
+"""
+
+import argparse, contextlib, json, os, platform, sys, time, tracemalloc
+import snappy
+from . import double_group, disorder
+
+panel = [('m003(-3,1)', 3), ('m003(-3,1)', 5), ('m004(1,2)', 3), ('m004(1,2)', 4),
+         ('m016(-4,1)', 4), ('m070(-2,3)', 4), ('m249(3,1)', 4)]
+
+stages = ['ball', 'saturate', 'saturate_biorder', 'search', 'check_proof']
+
+def measure(function, memory=True, setup=None):
+    """
+    Runs function and returns its value, the wall time in seconds, and,
+    if memory is True, the peak memory in bytes allocated by Python
+    during a second run.  If setup is given, it is called before each
+    run, outside the measurement, and its value is passed to function.
+    """
+    args = [setup()] if setup is not None else []
+    start = time.perf_counter()
+    value = function(*args)
+    wall_time = time.perf_counter() - start
+    peak = None
+    if memory:
+        args = [setup()] if setup is not None else []
+        tracemalloc.start()
+        try:
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return value, wall_time, peak
+
+@contextlib.contextmanager
+def captured_balls():
+    """
+    Records every ball handed out by Double3ManifoldGroup.ball while
+    active, so the products evaluated by a search can be counted.
+    """
+    balls = []
+    original = double_group.Double3ManifoldGroup.ball
+    def ball(self, *args, **kwargs):
+        B = original(self, *args, **kwargs)
+        balls.append(B)
+        return B
+    double_group.Double3ManifoldGroup.ball = ball
+    try:
+        yield balls
+    finally:
+        double_group.Double3ManifoldGroup.ball = original
+
+def first_saturations(G, B, biorder):
+    """
+    Builds the root monoid of the search and its two children.  The
+    ball B should be fresh, so that every product needed is evaluated.
+    """
+    P = disorder.MonoidInGroup([G('a')], B, biorder=biorder)
+    k = disorder.branch_pair(B, P)
+    if k is not None:
+        for side in [0, 1]:
+            P.copy().saturate([B.pair_element(k, side)], biorder)
+    return B
+
+def import_check_proof():
+    """
+    The check_proof module from the top of the source tree, or None if
+    it, or Sage, is not available.
+    """
+    directory = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__)))), 'check_proof')
+    if os.path.isdir(directory) and directory not in sys.path:
+        sys.path.append(directory)
+    try:
+        import check_proof
+    except ImportError:
+        return None
+    return check_proof
+
+def benchmark_one(name, radius, which=stages, memory=True):
+    """
+    The results of the given stages for one manifold and radius, as a
+    list of dicts.
+
+    >>> results = benchmark_one('m003(-3,1)', 2, ['ball', 'saturate'], memory=False)
+    >>> [(r['stage'], r['elements']) for r in results]
+    [('ball', 37), ('saturate', 37)]
+    >>> results[1]['products'] > 0
+    True
+    """
+    M = snappy.Manifold(name)
+    G = double_group.Double3ManifoldGroup(M)
+    results = []
+    def record(stage, wall_time, peak, **extra):
+        result = {'manifold':name, 'radius':radius, 'stage':stage,
+                  'wall_time':round(wall_time, 4), 'peak_memory':peak}
+        result.update(extra)
+        results.append(result)
+
+    if 'ball' in which:
+        B, wall_time, peak = measure(lambda : G.ball(radius), memory)
+        record('ball', wall_time, peak, elements=len(B), products=0)
+    for stage, biorder in [('saturate', False), ('saturate_biorder', True)]:
+        if stage in which:
+            B, wall_time, peak = measure(
+                lambda B : first_saturations(G, B, biorder), memory,
+                setup=lambda : G.ball(radius))
+            record(stage, wall_time, peak, elements=len(B),
+                   products=B.products_computed())
+    if 'search' in which:
+        with captured_balls() as balls:
+            ans, wall_time, peak = measure(lambda : disorder.has_non_orderable_group(
+                M, ball_radius=radius, silent=True), memory)
+        record('search', wall_time, peak, elements=len(balls[0]),
+               products=balls[0].products_computed(), nonorderable=ans)
+    if 'check_proof' in which:
+        check_proof = import_check_proof()
+        ans, proof = disorder.has_non_orderable_group(
+            M, ball_radius=radius, silent=True, return_proof=True)
+        if check_proof is None:
+            record('check_proof', 0.0, None, skipped='check_proof needs Sage')
+        elif not ans:
+            record('check_proof', 0.0, None, skipped='no proof found')
+        else:
+            proof = json.loads(proof)
+            ok, wall_time, peak = measure(lambda : check_proof.check_proof(proof), memory)
+            record('check_proof', wall_time, peak, leaves=len(proof['proof']),
+                   checked=ok)
+    return results
+
+def benchmark(cases=panel, which=stages, memory=True, silent=False):
+    """
+    Runs the benchmark over the given list of (manifold, radius) pairs.
+    """
+    results = []
+    for name, radius in cases:
+        for result in benchmark_one(name, radius, which, memory):
+            if not silent:
+                print(format_result(result))
+            results.append(result)
+    return {'python':platform.python_version(),
+            'platform':platform.platform(),
+            'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results':results}
+
+def format_result(result, old=None):
+    line = '%-12s %d  %-17s %8.3fs' % (result['manifold'], result['radius'],
+                                       result['stage'], result['wall_time'])
+    if result['peak_memory'] is not None:
+        line += ' %9.1fMB' % (result['peak_memory'] / 2.0**20)
+    if 'products' in result:
+        line += ' %10d products' % result['products']
+    if 'skipped' in result:
+        line += '  skipped: ' + result['skipped']
+    if old is not None and old['wall_time'] > 0:
+        line += '  (%.2fx)' % (result['wall_time'] / old['wall_time'])
+    return line
+
+def compare(new, old):
+    """
+    Prints the results of new next to the ratio of their wall time to
+    the corresponding results of old.
+    """
+    key = lambda r : (r['manifold'], r['radius'], r['stage'])
+    old_results = dict((key(r), r) for r in old['results'])
+    for result in new['results']:
+        print(format_result(result, old_results.get(key(result))))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--stages', nargs='+', choices=stages, default=stages)
+    parser.add_argument('--manifolds', nargs='+', metavar='NAME:RADIUS',
+                        help='panel to use instead of the default one')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the second run of each stage that measures memory')
+    args = parser.parse_args(args)
+    cases = panel
+    if args.manifolds:
+        cases = [(case.rsplit(':', 1)[0], int(case.rsplit(':', 1)[1]))
+                 for case in args.manifolds]
+    silent = args.compare is not None
+    new = benchmark(cases, args.stages, not args.no_memory, silent)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(new, json.load(file))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(new, file, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Budgets and resumable checkpoints for the search in
+disorder.has_non_orderable_group.
+
+The state of the depth first search is the path from the root to the
+current node: at each level, the pair branched on and which side of
+it is being explored.  Together with the proof leaves found so far,
+this is enough to resume the search, since the monoid at each node is
+rebuilt by saturating along the path again.  A checkpoint is a small
+JSON file holding this state; the ball itself is rebuilt, or loaded
+from the cache, from the group.
+"""
+
+import json, os, tempfile, time
+
+class SearchInterrupted(Exception):
+    """
+    Raised inside the search when the budget runs out, after the
+    checkpoint has been written.
+    """
+    pass
+
+def write_json(path, data):
+    """
+    Writes data to path as JSON, under a temporary name first so a
+    reader never sees a partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+class SearchState(object):
+    """
+    Keeps track of the path to the current node of the search, stops
+    the search once max_nodes nodes have been visited or max_time
+    seconds have passed, and writes the state to the checkpoint file,
+    if any, when stopping and every interval seconds.  The header is a
+    dict describing the search, including the radius the search
+    started at, which must match when resuming; the radius of the
+    ball being searched, which can be larger, is saved with the state.
+
+    >>> import tempfile, os
+    >>> path = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+    >>> state = SearchState({'manifold':'m003(-3,1)'}, path, max_nodes=1)
+    >>> state.visit(None, None, None)
+    True
+    >>> state.enter(4, 1, frozenset([0, 3]), 0, 2)
+    >>> state.visit(None, None, None)
+    Traceback (most recent call last):
+    ...
+    quickdisorder.checkpoint.SearchInterrupted: node budget exhausted
+    >>> resumed = SearchState({'manifold':'m003(-3,1)'}, path)
+    >>> resumed.next_level()
+    {'pair': 4, 'side': 1, 'learned': [0, 3], 'start': 0, 'subtree': 2}
+    >>> resumed.next_level() is None
+    True
+    >>> SearchState({'manifold':'m004(1,2)'}, path)
+    Traceback (most recent call last):
+    ...
+    ValueError: The checkpoint is for a different search
+    """
+    def __init__(self, header, path=None, max_nodes=None, max_time=None, interval=600):
+        self.header, self.path = header, path
+        self.max_nodes, self.max_time, self.interval = max_nodes, max_time, interval
+        self.start_time = self.last_save = time.time()
+        self.nodes = 0
+        self.radius = None
+        self.stack = []
+        self.resume, self.saved = [], None
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                saved = json.load(file)
+            if saved['header'] != header:
+                raise ValueError('The checkpoint is for a different search')
+            self.resume, self.saved = saved['stack'], saved
+            self.radius = saved['radius']
+
+    def begin(self, radius):
+        """
+        Called at the start of the search of the ball of the given
+        radius.
+        """
+        self.radius, self.stack = radius, []
+
+    def enter(self, pair, side, learned, start, subtree):
+        """
+        Records that the search is going down the given side of the
+        given pair, along with what is needed to finish the node.
+        """
+        self.stack.append({'pair':pair, 'side':side, 'learned':sorted(learned),
+                           'start':start, 'subtree':subtree})
+
+    def leave(self):
+        self.stack.pop()
+
+    def next_level(self):
+        """
+        The saved state of the next node on the path being resumed,
+        or None once the path has been followed to its end.
+        """
+        if self.resume:
+            return self.resume.pop(0)
+        return None
+
+    def visit(self, printer, strategy, nogoods):
+        """
+        Called at each node.  Writes a checkpoint when one is due and
+        raises SearchInterrupted when the budget is exhausted.  The
+        nodes on the path being resumed don't count, so that each run
+        makes progress; for these False is returned, and otherwise
+        True.
+        """
+        if self.resume:
+            return False
+        self.nodes += 1
+        now = time.time()
+        reason = None
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            reason = 'node budget exhausted'
+        elif self.max_time is not None and now - self.start_time > self.max_time:
+            reason = 'time budget exhausted'
+        if reason or now - self.last_save > self.interval:
+            self.save(printer, strategy, nogoods)
+        if reason:
+            raise SearchInterrupted(reason)
+        return True
+
+    def save(self, printer, strategy, nogoods):
+        if self.path is None:
+            return
+        leaves = printer.saved_leaves() if printer is not None else None
+        data = {'header':self.header, 'radius':self.radius, 'stack':self.stack,
+                'leaves':leaves}
+        if strategy is not None:
+            data['counters'] = strategy.counters()
+        if nogoods is not None:
+            data['nogoods'] = [[sorted(nogood), word] for nogood, word in nogoods.nogoods]
+        write_json(self.path, data)
+        self.last_save = time.time()
+
+    def restore(self, printer, strategy, nogoods):
+        """
+        Puts back the proof leaves, counters and nogoods found before
+        the checkpoint was written.
+        """
+        if self.saved is None:
+            return
+        if self.saved.get('leaves') is not None:
+            printer.restore_leaves(self.saved['leaves'])
+        if 'counters' in self.saved:
+            strategy.nodes = self.saved['counters']['nodes']
+            strategy.contradictions = self.saved['counters']['contradictions']
+        if nogoods is not None:
+            for nogood, word in self.saved.get('nogoods', []):
+                nogoods.add(frozenset(nogood), word)
+
+    def finish(self):
+        """
+        Removes the checkpoint once the search is over.
+        """
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,125 +1,252 @@
-import json
-from . import double_group
+import json, time
+from . import double_group, ball as balls, parallel, strategy as strategies, nogood, checkpoint as checkpoints
 
 class MonoidInGroup(object):
     """
+    A submonoid of the group, restricted to a CayleyBall.  Elements
+    are stored by their ids in the ball, and saturation walks the
+    ball's lists of products which stay in the ball.
+
     If track is True, remember how each element in self can be
-    expressed in terms of the given monoid generators.
+    expressed in terms of the given monoid generators.  The
+    dictionary expressed_in_gens maps the id of each element to where
+    it came from: the word of a generator, the pair of ids of the
+    factors of a product, or a triple (g, y, side) for a conjugate of
+    y by g.  Only when an expression is needed is this expanded into
+    a list of words by expression().
+
+    >>> import snappy
+    >>> G = double_group.Double3ManifoldGroup(snappy.Manifold('m003(-3,1)'))
+    >>> P = MonoidInGroup([G('a'), G('b')], G.ball(3), track=True)
+    >>> P.has_one(), '*'.join(P.word_rep_one())
+    (True, 'b*a*a*a*b*b*a*b*a*b')
+
+    Once mark() has been called, saturation records the ids it adds
+    on a trail, and undo(mark) removes them again.  This allows the
+    search to backtrack without copying the monoid.
+
+    Only elements of the ball can be added, but any element can be
+    tested for membership.
+
+    >>> G('aaaaaaaa') in P
+    False
+    >>> P.saturate([G('aaaaaaaa')], False)
+    Traceback (most recent call last):
+        ...
+    ValueError: aaaaaaaa is not in the ball
     """
     def __init__(self, elements, ball, biorder=False, saturate=True, track=False):
         self.ball, self.biorder, self.track = ball, biorder, track
         if track:
             self.expressed_in_gens = dict()
-            self._word_rep_one = None
+            self._one = None
+        self.trail = None
+        self.ids = set()
         if saturate:
-            self.elements = set()
             self._has_one = self.saturate(elements, biorder)
         else:
-            self.elements = elements.copy()
-        
+            for e in elements:
+                self.ids.add(self._id_in_ball(e))
+
+    def _id_in_ball(self, x):
+        i = self.ball.id_of(x)
+        if i == balls.OUTSIDE:
+            raise ValueError('%s is not in the ball' % x.word)
+        return i
+
     def saturate(self, new_elements, biorder):
         """
         Returns whether 1 is in self after saturation
         """
-        active = set(new_elements)
-        ans = self.elements | set(active)
-
-        track = self.track
+        ball = self.ball
+        gens = dict((self._id_in_ball(x), x) for x in new_elements)
+        active = list(gens)
+        ids, trail, track = self.ids, self.trail, self.track
         if track:
             in_gens = self.expressed_in_gens
-            for x in active:
-                in_gens[x] = [x.word]
-
+        for i, x in gens.items():
+            if i not in ids:
+                ids.add(i)
+                if trail is not None:
+                    trail.append(i)
+                if track:
+                    in_gens[i] = x.word
+
+        # Since all products are looked up in the ball's table, the
+        # elements of self are always the ball's own representatives,
+        # which prevents the accumulation of numerical error.
+        neighbors, conjugates, one_ids = ball.neighbors, ball.conjugates, ball.one_ids
         while len(active) > 0:
-            new_elts = set()
+            new_elts = []
             for y in active:
                 if biorder:
-                    for g in ans:
-                        z = g*y*g.inverse()
-                        if z in self.ball.elements and z not in ans:
-                            # The next application of the "identity" map is
-                            # to try to prevent accumulation of numerical error.
-                            z = self.ball.element_dict[z]
-                            new_elts.add(z)
-                            if track:
-                                in_gens[z] = [g.word] + in_gens[y] + [g.word.swapcase()]
-                            if z.is_one():
-                                self.elements = ans | new_elts
-                                self._has_one = True
+                    for side in [0, 1]:
+                        conjugators, conjugated = conjugates(y, side)
+                        for g, z in zip(conjugators, conjugated):
+                            if z not in ids and g in ids:
+                                ids.add(z)
+                                new_elts.append(z)
+                                if trail is not None:
+                                    trail.append(z)
                                 if track:
-                                    self._word_rep_one = in_gens[z]
-                                return True
-                        z = g.inverse()*y*g
-                        if z in self.ball.elements and z not in ans:
-                            # The next application of the "identity" map is
-                            # to try to prevent accumulation of numerical error.
-                            z = self.ball.element_dict[z]
-                            new_elts.add(z)
+                                    in_gens[z] = (g, y, side)
+                                if z in one_ids:
+                                    return self._found_one(z)
+                # Only the products of y which stay in the ball need
+                # to be looked at.  A product of two elements of self
+                # is found when the later of the two is active.
+                for side in [0, 1]:
+                    others, products = neighbors(y, side)
+                    for x, z in zip(others, products):
+                        if z not in ids and x in ids:
+                            ids.add(z)
+                            new_elts.append(z)
+                            if trail is not None:
+                                trail.append(z)
                             if track:
-                                in_gens[z] = [g.word.swapcase()] + in_gens[y] + [g.word]
-                            if z.is_one():
-                                self.elements = ans | new_elts
-                                self._has_one = True
-                                if track:
-                                    self._word_rep_one = in_gens[z]
-                                return True
-                for x in ans:
-                    for a, b in [(x, y), (y, x)]:
-                        z = a*b
-                        if z in self.ball.elements and z not in ans:
-                            # The next application of the "identity" map is
-                            # to try to prevent accumulation of numerical error.
-                            z = self.ball.element_dict[z]
-                            new_elts.add(z)
-                            if track:
-                                in_gens[z] = in_gens[a] + in_gens[b]                            
-                            if z.is_one():
-                                self.elements = ans | new_elts
-                                self._has_one = True
-                                if track:
-                                    self._word_rep_one = in_gens[z]
-                                return True
+                                in_gens[z] = (y, x) if side == 0 else (x, y)
+                            if z in one_ids:
+                                return self._found_one(z)
 
-            ans = ans | new_elts
             active = new_elts
 
-        self.elements = ans
         return False
 
+    def _found_one(self, one):
+        self._has_one = True
+        if self.track:
+            self._one = one
+        return True
+
+    def expression(self, i):
+        """
+        The element of self with id i as a list of words in the
+        generators of self, as recorded when track is True.
+        """
+        in_gens, ball = self.expressed_in_gens, self.ball
+        ans, stack = [], [i]
+        while stack:
+            x = stack.pop()
+            if isinstance(x, str):
+                ans.append(x)
+                continue
+            source = in_gens[x]
+            if isinstance(source, str):
+                ans.append(source)
+            elif len(source) == 2:
+                stack += [source[1], source[0]]
+            else:
+                g, y, side = source
+                word = ball.element(g).word
+                if side == 0:
+                    stack += [word.swapcase(), y, word]
+                else:
+                    stack += [word, y, word.swapcase()]
+        return ans
+
+    def support(self, i):
+        """
+        The ids of the generators of self used in the expression of
+        the element with id i.
+        """
+        in_gens = self.expressed_in_gens
+        ans, seen, stack = set(), set(), [i]
+        while stack:
+            x = stack.pop()
+            if x in seen:
+                continue
+            seen.add(x)
+            source = in_gens[x]
+            if isinstance(source, str):
+                ans.add(x)
+            else:
+                stack += source[:2]
+        return frozenset(ans)
+
+    def generator_ids(self):
+        """
+        The ids of the generators of self, when tracking.
+        """
+        return frozenset(i for i, source in self.expressed_in_gens.items()
+                         if isinstance(source, str))
+
+    def word_rep_one(self):
+        """
+        An expression of 1 in the generators of self, if 1 has been
+        found in self while tracking.
+        """
+        if self._one is None:
+            return None
+        return self.expression(self._one)
+
     def has_one(self):
         return self._has_one
 
+    def mark(self):
+        """
+        Returns a marker recording the current state, for use with
+        undo.  Starts the trail if it is not already running.
+        """
+        if self.trail is None:
+            self.trail = []
+        one = self._one if self.track else None
+        return len(self.trail), self._has_one, one
+
+    def undo(self, mark):
+        """
+        Restores self to the state it was in when mark was created.
+        """
+        length, self._has_one, one = mark
+        trail, ids = self.trail, self.ids
+        if self.track:
+            self._one = one
+            in_gens = self.expressed_in_gens
+            for i in trail[length:]:
+                del in_gens[i]
+        for i in trail[length:]:
+            ids.discard(i)
+        del trail[length:]
+
     def copy(self):
-        M = MonoidInGroup(self.elements, self.ball, self.biorder, False, self.track)
+        M = self.__class__([], self.ball, self.biorder, False, self.track)
+        M.ids = self.ids.copy()
         M._has_one = self._has_one
         if self.track:
-            M._word_rep_one = self._word_rep_one
+            M._one = self._one
             M.expressed_in_gens = self.expressed_in_gens.copy()
         return M
-        
+
+    @property
+    def elements(self):
+        return set(self.ball.element(i) for i in self.ids)
+
     def words(self):
         ans = [a.word for a in self.elements]
         ans.sort(key=lambda x: (len(x), x))
         return ans
 
+    def contains_id(self, i):
+        return i in self.ids
+
     def __contains__(self, x):
-        return x in self.elements
+        i = self.ball.id_of(x)
+        return i != balls.OUTSIDE and i in self.ids
 
     def __len__(self):
-        return len(self.elements)
+        return len(self.ids)
 
 class Printer(object):
     def __init__(self, silent=False):
         self.silent = silent
 
     def size_of_ball(self, B, depth):
-        self.write('Ball has %d elements' % len(B.elements), depth)
+        self.write('Ball has %d elements' % len(B), depth)
         
     def add_monoid_gen(self, element, depth):
         self.write('Adding %s' % element.word, depth)
 
     def size_of_monoid(self, P, depth):
-        self.write('Size of P is %d' % len(P.elements), depth)
+        self.write('Size of P is %d' % len(P), depth)
 
     def contradiction(self, word, depth):
         if word:
@@ -128,22 +255,49 @@ class Printer(object):
         else:
             self.write('Contradiction: 1 in P', depth)
             
+    def mark(self):
+        """
+        Marks the start of a subtree of the proof; see splice.
+        """
+        return None
+
+    def splice(self, mark, depth, start=None):
+        """
+        Moves the leaves found since mark up past the edge at the given
+        depth, for when they did not use that edge.  If start is given,
+        the leaves found between start and mark are dropped.
+        """
+        pass
+
+    def saved_leaves(self):
+        """
+        The proof leaves found so far, in the form saved in a
+        checkpoint; see restore_leaves.
+        """
+        return None
+
+    def restore_leaves(self, saved):
+        pass
+
     def write(self, string, depth):
         if not self.silent:
             print('  '*depth + '%d: ' % depth + string)
 
     def proof_string(self, manifold, args):
-        G = manifold.fundamental_group(*args)
-        ans = {'name':repr(manifold),
-               'group_args':[1 if x else 0 for x in args],
-               'gens':'.'.join(G.generators()),
-               'rels':G.relators(),
-               'proof':self.value,
-               }
-        
-        return json.dumps(ans).replace(' ', '')
+        ans = proof_header(manifold, args)
+        ans['proof'] = self.value
+        return json.dumps(ans, separators=(',', ':'))
 
-    
+def proof_header(manifold, args):
+    """
+    Everything in a proof except its leaves.
+    """
+    G = manifold.fundamental_group(*args)
+    return {'name':repr(manifold),
+            'group_args':[1 if x else 0 for x in args],
+            'gens':'.'.join(G.generators()),
+            'rels':G.relators(),
+            }
     
 class ProofPrinter(Printer):
     """
@@ -191,50 +345,269 @@ class ProofPrinter(Printer):
             self.value.append(['.'.join(self.edges_back_to_root), '.'.join(word)])
         self.edges_back_to_root = self.edges_back_to_root[:-1]
         Printer.contradiction(self, word, depth)
+
+    def mark(self):
+        return len(self.value)
+
+    def splice(self, mark, depth, start=None):
+        for leaf in self.value[mark:]:
+            edges = leaf[0].split('.')
+            leaf[0] = '.'.join(edges[:depth] + edges[depth + 1:])
+        if start is not None:
+            del self.value[start:mark]
+
+    def extend(self, leaves):
+        self.value += leaves
+
+    def saved_leaves(self):
+        return self.value
+
+    def restore_leaves(self, saved):
+        self.value = saved
+
+class StreamingProofPrinter(ProofPrinter):
+    """
+    A ProofPrinter which writes the leaves to a file as they are
+    found, rather than keeping them, so that memory use does not grow
+    with the size of the proof and the progress of the search can be
+    followed on disk.  The file is in JSON Lines format: a first line
+    with the proof_header, then a line for each leaf, a line
+    {"splice":[mark,depth,start]} each time the search moves leaves
+    up past an edge, and a last line {"answer":...,"leaves":...}
+    written by finish().  Use read_proof_stream to turn it into a
+    proof as returned by proof_string.
+    """
+    def __init__(self, silent, path, header):
+        ProofPrinter.__init__(self, silent)
+        self.path, self.header = path, header
+        self.file = None
+        self.count = 0
+
+    def _open(self):
+        if self.file is None:
+            self.file = open(self.path, 'wb')
+            self._write_line(self.header)
+
+    def _write_line(self, data):
+        self.file.write(json.dumps(data, separators=(',', ':')).encode() + b'\n')
+        self.file.flush()
+
+    def contradiction(self, word, depth):
+        if word is not None:
+            self._open()
+            self._write_line(['.'.join(self.edges_back_to_root), '.'.join(word)])
+            self.count += 1
+        self.edges_back_to_root = self.edges_back_to_root[:-1]
+        Printer.contradiction(self, word, depth)
+
+    def mark(self):
+        return self.count
+
+    def splice(self, mark, depth, start=None):
+        self._open()
+        self._write_line({'splice':[mark, depth, start]})
+        if start is not None:
+            self.count -= mark - start
+
+    def extend(self, leaves):
+        self._open()
+        for leaf in leaves:
+            self._write_line(leaf)
+        self.count += len(leaves)
+
+    def saved_leaves(self):
+        self._open()
+        return {'count':self.count, 'offset':self.file.tell()}
+
+    def restore_leaves(self, saved):
+        """
+        Goes back to the end of the leaves written when the
+        checkpoint was saved.
+        """
+        self.close()
+        self.file = open(self.path, 'r+b')
+        self.file.truncate(saved['offset'])
+        self.file.seek(saved['offset'])
+        self.count = saved['count']
+
+    def finish(self, ans):
+        self._open()
+        self._write_line({'answer':ans, 'leaves':self.count})
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def proof_string(self, manifold, args):
+        return json.dumps(read_proof_stream(self.path), separators=(',', ':'))
+
+def read_proof_stream(path):
+    """
+    Reads the file written by a StreamingProofPrinter, returning the
+    proof as a dict in the format of ProofPrinter.proof_string.
+    Raises ValueError unless the file holds a finished proof.
+    """
+    replay = ProofPrinter(silent=True)
+    ans = None
+    with open(path) as file:
+        header = json.loads(file.readline())
+        for line in file:
+            data = json.loads(line)
+            if isinstance(data, list):
+                replay.value.append(data)
+            elif 'splice' in data:
+                replay.splice(*data['splice'])
+            else:
+                ans = data
+    if ans is None:
+        raise ValueError('The proof in %s is not finished' % path)
+    if not ans['answer'] or ans['leaves'] != len(replay.value):
+        raise ValueError('The file %s does not hold a proof' % path)
+    header['proof'] = replay.value
+    return header
     
-def ball_has_order(B, P, biorder, printer, recur_depth):
+def ball_has_order(B, P, biorder, printer, recur_depth, trail=False, strategy=None,
+                   nogoods=None, choices=None, state=None, monitor=None):
+    """
+    Searches for a contradiction in every way of extending P by
+    choosing one of each pair {g, g^-1} in B.  If trail is True, P
+    itself is modified in place and restored on backtracking, rather
+    than being copied at each node.  The pairs to branch on are
+    chosen by strategy; see quickdisorder.strategy.
+
+    If nogoods is a NogoodStore, P must be tracking, and the search
+    learns from its contradictions as described in quickdisorder.nogood.
+    Then choices is the set of ids of the generators of P, which is
+    computed if not given.
+
+    If state is a checkpoint.SearchState, the search keeps it up to
+    date, stops when its budget is exhausted, and first follows the
+    path it is resuming, skipping the parts of the tree done before.
+
+    If monitor is given, it is told about each node, saturation and
+    contradiction; see quickdisorder.monitor.
+    """
+    if strategy is None:
+        strategy = strategies.FirstPair()
+    # The nodes on a path being resumed were counted before.
+    counted = state.visit(printer, strategy, nogoods) if state is not None else True
+    if counted:
+        strategy.nodes += 1
+        if monitor is not None:
+            monitor.node(recur_depth, len(P))
     printer.size_of_monoid(P, recur_depth)
     if P.has_one():
+        strategy.contradictions += 1
+        if monitor is not None:
+            monitor.contradiction(recur_depth)
         if P.track:
-            word = P._word_rep_one
+            word = P.word_rep_one()
         else:
             word = None
+        if nogoods is not None:
+            nogoods.learn(P.support(P._one), word)
         printer.contradiction(word, recur_depth)
         return False, P
 
-    # If we get close to building a full P, we almost always get
-    # there.  It is better to stop now and later try again with an
-    # increased radius, because adding those last few elements is very
-    # expensive.
-    if len(P) > 0.9 * 0.5 * len(B.elements):
+    if monitor is not None and counted:
+        started = time.perf_counter()
+        k = strategy.choose(B, P, biorder)
+        monitor.branched(recur_depth, time.perf_counter() - started)
+    else:
+        k = strategy.choose(B, P, biorder)
+    if k is None:
         return True, P
-    for x, y in B.non_id_element_pairs:
-        if (x not in P) and (y not in P):
-            printer.add_monoid_gen(x, recur_depth)
-            newP = P.copy()
-            newP.saturate([x], biorder)
-            ans = ball_has_order(B, newP, biorder, printer, recur_depth+1)
-            if ans[0]:
-                return ans
+    if nogoods is not None and choices is None:
+        choices = P.generator_ids()
+    learned, start = frozenset(), printer.mark()
+    resume = state.next_level() if state is not None else None
+    if resume is not None:
+        if resume['pair'] != k:
+            raise ValueError('The checkpoint does not match this search')
+        learned, start = frozenset(resume['learned']), resume['start']
+    for side in [0, 1]:
+        if resume is not None and side < resume['side']:
+            continue
+        z = B.pair_element(k, side)
+        printer.add_monoid_gen(z, recur_depth)
+        subtree = printer.mark()
+        resuming = resume is not None and side == resume['side']
+        if resuming:
+            subtree = resume['subtree']
+        if state is not None:
+            state.enter(k, side, learned, start, subtree)
+        if nogoods is not None:
+            i = B.id_pairs[k][side]
+            new_choices = choices | frozenset([i])
+            known = nogoods.find(new_choices)
+            if known is not None:
+                strategy.nodes += 1
+                strategy.contradictions += 1
+                if monitor is not None:
+                    monitor.node(recur_depth + 1, len(P))
+                    monitor.contradiction(recur_depth + 1)
+                nogoods.last = known[0]
+                printer.contradiction(known[1], recur_depth + 1)
+                ans = (False, P)
+        else:
+            new_choices, known = None, None
+        if known is None:
+            if trail:
+                mark = P.mark()
+                newP = P
             else:
-                printer.add_monoid_gen(y, recur_depth)
                 newP = P.copy()
-                newP.saturate([y], biorder)
-                return ball_has_order(B, newP, biorder, printer, recur_depth+1)
-    return True, P
+            if monitor is not None and not resuming:
+                before, started = len(newP), time.perf_counter()
+                newP.saturate([z], biorder)
+                monitor.saturated(recur_depth + 1, before, len(newP),
+                                  time.perf_counter() - started)
+            else:
+                newP.saturate([z], biorder)
+            ans = ball_has_order(B, newP, biorder, printer, recur_depth+1, trail,
+                                 strategy, nogoods, new_choices, state, monitor)
+            if ans[0]:
+                return ans
+            if trail:
+                P.undo(mark)
+        if state is not None:
+            state.leave()
+        if nogoods is not None:
+            if i not in nogoods.last:
+                # The subtree below z never used z, so it closes this
+                # node by itself.
+                printer.splice(subtree, recur_depth, start)
+                return ans
+            learned |= nogoods.last - frozenset([i])
+    if nogoods is not None:
+        nogoods.last = learned
+    return ans
+
+def branch_pair(B, P, strategy=None, biorder=False):
+    """
+    Returns the index in B.id_pairs of the pair {g, g^-1}
+    to branch on next, or None if the search should stop here because
+    P is (nearly) the positive cone of an order.
+    """
+    if strategy is None:
+        strategy = strategies.FirstPair()
+    return strategy.choose(B, P, biorder)
 
 def conj_inv_obstruction(P, B, full_check=False):
     if full_check:
         S=B
     else:
         S=P
-    for x in S.elements:
-        for y in S.elements:
+    elements = S.elements
+    for x in elements:
+        for y in elements:
             ybar = y.inverse()
             z = x * ybar
             u = ybar * x
             ubar = u.inverse()
-            if (z in P.elements) and (ubar in P.elements):
+            if (z in P) and (ubar in P):
                 print(x.word + ' * ' + y.word + ' is in P, but ' + y.word + ' * ' + x.word + ' is in P^-1.')
                 return True
     return False
@@ -244,7 +617,12 @@ def has_non_orderable_group(manifold, ball_radius=3,
                             biorder=False,
                             silent=False, track=False, return_proof=False,
                             min_bits_accuracy=15,
-                            fundamental_group_args = [True, True, False]):
+                            fundamental_group_args = [True, True, False],
+                            trail=False, workers=None,
+                            max_ball_radius=None, cache_dir=None, shared_ball=False,
+                            strategy=None, nogoods=False, max_nodes=None, max_time=None,
+                            checkpoint=None, checkpoint_interval=600, monitor=None,
+                            proof_file=None):
     """
     >>> import snappy
     >>> M = snappy.Manifold('m003(-3,1)')
@@ -293,21 +671,184 @@ def has_non_orderable_group(manifold, ball_radius=3,
     >>> manifolds = [snappy.Manifold(name) for name in names]
     >>> [has_non_orderable_group(M, silent=True) for M in manifolds]
     [False, False, True, True, True, True, False, False]
+
+    With trail=True, the search backtracks by undoing the changes to a
+    single monoid instead of copying it at each node, so memory use
+    does not grow with the depth of the search.
+
+    >>> [has_non_orderable_group(M, silent=True, trail=True) for M in manifolds]
+    [False, False, True, True, True, True, False, False]
+
+    With workers=N, the subtrees of the search are explored by a pool
+    of N processes; see quickdisorder.parallel.
+
+    >>> [has_non_orderable_group(M, silent=True, workers=2) for M in manifolds]
+    [False, False, True, True, True, True, False, False]
+    >>> ans, proof = has_non_orderable_group(M, silent=True, return_proof=True, workers=2)
+    >>> len(json.loads(proof)['proof'])
+    3
+
+    If max_ball_radius is given and the search fails, it is retried
+    with the ball grown by one, reusing the group and the ball, until
+    the radius reaches max_ball_radius.
+
+    >>> K = snappy.Manifold('m249(3,1)')
+    >>> has_non_orderable_group(K, ball_radius=2, silent=True)
+    False
+    >>> has_non_orderable_group(K, ball_radius=2, max_ball_radius=4, silent=True)
+    True
+
+    If cache_dir is given, the holonomy and the balls are cached there
+    as described in Double3ManifoldGroup.  With shared_ball=True, the
+    cached ball is memory mapped read-only, so that many processes
+    working on one machine share a single copy of it.
+
+    The strategy for choosing the pair to branch on at each node can
+    be given by name or as an object from quickdisorder.strategy,
+    which also counts the nodes explored.
+
+    >>> from quickdisorder.strategy import FirstPair, LargestGrowth, RecordedOrder
+    >>> first, growth = FirstPair(), LargestGrowth()
+    >>> has_non_orderable_group(K, ball_radius=4, silent=True, strategy=first)
+    True
+    >>> has_non_orderable_group(K, ball_radius=4, silent=True, strategy=growth)
+    True
+    >>> growth.nodes < first.nodes
+    True
+    >>> ans, proof = has_non_orderable_group(K, ball_radius=4, silent=True,
+    ...                                      return_proof=True, strategy='growth')
+    >>> recorded = RecordedOrder(proof)
+    >>> has_non_orderable_group(K, ball_radius=4, silent=True, strategy=recorded)
+    True
+    >>> recorded.nodes == growth.nodes
+    True
+
+    With nogoods=True, the search learns which generators each
+    contradiction depends on, as described in quickdisorder.nogood,
+    and skips the branches this shows to be unnecessary.
+
+    >>> learning = FirstPair()
+    >>> has_non_orderable_group(K, ball_radius=4, silent=True, strategy=learning,
+    ...                         nogoods=True)
+    True
+    >>> learning.nodes < first.nodes
+    True
+
+    The search can be given a budget of max_nodes nodes or max_time
+    seconds; if it runs out, the answer is None.  With checkpoint set
+    to a file name, the state of the search is saved there every
+    checkpoint_interval seconds and when the budget runs out, and a
+    later call with the same arguments resumes from it.  The file is
+    removed once the search is over.
+
+    >>> import tempfile, os
+    >>> path = os.path.join(tempfile.mkdtemp(), 'K.json')
+    >>> ans, proof = has_non_orderable_group(K, ball_radius=4, silent=True,
+    ...     return_proof=True, max_nodes=10, checkpoint=path)
+    >>> ans, os.path.exists(path)
+    (None, True)
+
+    The checkpoint can only be resumed by a search of the same ball.
+
+    >>> has_non_orderable_group(K, ball_radius=5, silent=True,
+    ...     return_proof=True, max_nodes=10, checkpoint=path)
+    Traceback (most recent call last):
+    ...
+    ValueError: The checkpoint is for a different search
+    >>> while ans is None:
+    ...     ans, proof = has_non_orderable_group(K, ball_radius=4, silent=True,
+    ...         return_proof=True, max_nodes=10, checkpoint=path)
+    >>> ans, os.path.exists(path)
+    (True, False)
+    >>> len(json.loads(proof)['proof'])
+    15
+
+    To see where the time goes, pass a monitor from quickdisorder.monitor,
+    such as a MetricsCollector.
+
+    With proof_file set to a file name, the proof is recorded without
+    keeping it in memory by a StreamingProofPrinter writing to that
+    file.  It can be read back with read_proof_stream.
+
+    >>> path = os.path.join(tempfile.mkdtemp(), 'K.jsonl')
+    >>> has_non_orderable_group(K, ball_radius=4, silent=True, nogoods=True,
+    ...                         proof_file=path)
+    True
+    >>> streamed = read_proof_stream(path)
+    >>> ans, proof = has_non_orderable_group(K, ball_radius=4, silent=True, nogoods=True,
+    ...                                      return_proof=True)
+    >>> streamed == json.loads(proof)
+    True
     """
-    if return_proof:
-        track = True
-        printer = ProofPrinter(silent)
-    else:
-        printer = Printer(silent)
+    strategy = strategies.get_strategy(strategy)
+    store = nogood.NogoodStore() if nogoods else None
+    state = None
+    if max_nodes is not None or max_time is not None or checkpoint is not None:
+        if workers is not None and workers > 1:
+            raise ValueError('Budgets and checkpoints need a sequential search')
+        header = {'manifold':repr(manifold), 'ball_radius':ball_radius,
+                  'max_ball_radius':max_ball_radius, 'biorder':biorder, 'proof':return_proof,
+                  'strategy':strategy.__class__.__name__, 'nogoods':bool(nogoods),
+                  'min_bits_accuracy':min_bits_accuracy,
+                  'fundamental_group_args':list(fundamental_group_args)}
+        if proof_file is not None:
+            header['proof_file'] = proof_file
+        state = checkpoints.SearchState(header, checkpoint, max_nodes, max_time,
+                                        checkpoint_interval)
     G = double_group.Double3ManifoldGroup(
-              manifold, min_bits_accuracy, fundamental_group_args)
-    a = G('a')
-    B = G.ball(ball_radius)
-    printer.size_of_ball(B, 0)
-    printer.add_monoid_gen(a, 0)
-    P = MonoidInGroup([a], B, biorder=biorder, track=track)
-    ans = not ball_has_order(B, P, biorder, printer, 1)[0]
-
+              manifold, min_bits_accuracy, fundamental_group_args, cache_dir)
+    B = G.ball(ball_radius, shared_ball)
+    if state is not None and state.radius is not None:
+        B.grow(state.radius)
+        if B.radius != state.radius:
+            raise ValueError('The checkpoint is for a ball of radius %d' % state.radius)
+    while True:
+        if return_proof or nogoods or proof_file is not None:
+            track = True
+        if proof_file is not None:
+            printer = StreamingProofPrinter(
+                silent, proof_file, proof_header(manifold, fundamental_group_args))
+        elif return_proof:
+            printer = ProofPrinter(silent)
+        else:
+            printer = Printer(silent)
+        a = G('a')
+        printer.size_of_ball(B, 0)
+        printer.add_monoid_gen(a, 0)
+        if monitor is not None:
+            monitor.search_started(B)
+            started = time.perf_counter()
+        P = MonoidInGroup([a], B, biorder=biorder, track=track)
+        if monitor is not None and (state is None or not state.resume):
+            monitor.saturated(0, 0, len(P), time.perf_counter() - started)
+        if state is not None:
+            state.begin(B.radius)
+            state.restore(printer, strategy, store)
+        if workers is not None and workers > 1:
+            ans = not parallel.ball_has_order(B, P, biorder, printer, 1, trail, workers,
+                                              strategy, store, monitor)[0]
+        else:
+            try:
+                ans = not ball_has_order(B, P, biorder, printer, 1, trail, strategy,
+                                         store, state=state, monitor=monitor)[0]
+            except checkpoints.SearchInterrupted:
+                if proof_file is not None:
+                    printer.close()
+                if monitor is not None:
+                    monitor.search_finished(B, None)
+                return (None, None) if return_proof else None
+        if monitor is not None:
+            monitor.search_finished(B, ans)
+        if proof_file is not None:
+            printer.finish(ans)
+        if state is not None:
+            state.saved = None
+        if ans or max_ball_radius is None or B.radius >= max_ball_radius:
+            break
+        B.grow(B.radius + 1)
+
+    if state is not None:
+        state.finish()
     if return_proof:
         if ans:
             return ans, printer.proof_string(manifold, fundamental_group_args)
@@ -1,5 +1,9 @@
 import snappy
-from . import sl2matrix, ball
+import hashlib, json, os, re
+from . import sl2matrix, ball, flatfile
+
+# The precision used for the holonomy representation.
+holonomy_bits_prec = 100
 
 class Double3ManifoldGroup(object):
     """
@@ -10,20 +14,116 @@ class Double3ManifoldGroup(object):
     >>> B = G.ball(2)
     >>> len(B)
     37
+
+    The word of a product or inverse is only spelled out when it is
+    asked for.
+
+    >>> (G('ab') * G('c').inverse()).inverse().word
+    'cBA'
+
+    If cache_dir is given, the generator matrices and each ball are
+    saved there the first time they are computed, and loaded from
+    there afterwards.  A group loaded from the cache evaluates words
+    by multiplying the generator matrices in double precision.
+
+    >>> import tempfile
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> G = Double3ManifoldGroup(M, cache_dir=cache_dir)
+    >>> len(G.ball(3))
+    159
+    >>> H = Double3ManifoldGroup(M, cache_dir=cache_dir)
+    >>> H._rho is None
+    True
+    >>> C = H.ball(3)
+    >>> len(C), C.words == G.ball(3).words
+    (159, True)
+    >>> H('abcABC').key() == G('abcABC').key()
+    True
     """
-    def __init__(self, manifold, min_bits_accuracy=15, fundamental_group_args = [True, True, False]):
+    def __init__(self, manifold, min_bits_accuracy=15, fundamental_group_args = [True, True, False],
+                 cache_dir=None):
         self.manifold = manifold
-        self.rho = snappy.snap.polished_holonomy(manifold, 100,
-                                                 lift_to_SL2=True,
-                                                 fundamental_group_args=fundamental_group_args)
+        self.fundamental_group_args = fundamental_group_args
         self.min_bits_accuracy = min_bits_accuracy
+        self.cache_dir = cache_dir
+        self._rho = None
+        self._letters = None
+        if cache_dir is None:
+            self._rho = self._holonomy()
+        else:
+            self._load_generators()
+
+    def _holonomy(self):
+        return snappy.snap.polished_holonomy(self.manifold, holonomy_bits_prec,
+                                             lift_to_SL2=True,
+                                             fundamental_group_args=self.fundamental_group_args)
+
+    @property
+    def rho(self):
+        if self._rho is None:
+            self._rho = self._holonomy()
+        return self._rho
+
+    def generators(self):
+        if self._letters is not None:
+            return self._generators
+        return self.rho.generators()
 
     def __call__(self, word):
+        if self._letters is not None:
+            ans = self._letters['']
+            for letter in word:
+                ans = ans * self._letters[letter]
+            return ans
         A = self.rho(word)
         return sl2matrix.DoubleGroupElement(A, self.min_bits_accuracy, word)
 
-    def ball(self, radius):
-        return ball.CayleyBall(self, radius)
-
+    def ball(self, radius, shared=False):
+        """
+        The ball of the given radius.  When using a cache directory,
+        shared=True memory maps the cached ball read-only so that all
+        processes on a machine share one copy; see CayleyBall.load.
+        """
+        if self.cache_dir is None:
+            return ball.CayleyBall(self, radius)
+        path = self.cache_path('ball', radius=radius,
+                               min_bits_accuracy=self.min_bits_accuracy)
+        try:
+            return ball.CayleyBall.load(self, path, shared)
+        except (IOError, OSError, ValueError, KeyError, flatfile.FlatFileError):
+            B = ball.CayleyBall(self, radius)
+            B.save(path)
+            if shared:
+                B = ball.CayleyBall.load(self, path, shared)
+            return B
 
+    def cache_path(self, kind, **key):
+        """
+        The file in the cache directory for the given kind of data
+        about this group, distinguished by the extra key values.
+        """
+        key.update(name=repr(self.manifold),
+                   group_args=[1 if x else 0 for x in self.fundamental_group_args],
+                   bits_prec=holonomy_bits_prec)
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+        name = re.sub('[^A-Za-z0-9_.-]', '_', repr(self.manifold))
+        return os.path.join(self.cache_dir, '%s-%s.%s' % (name, digest[:16], kind))
 
+    def _load_generators(self):
+        """
+        Reads the generator matrices from the cache directory, or
+        computes them and saves them there.
+        """
+        path = self.cache_path('group')
+        try:
+            meta, arrays = flatfile.load(path)
+            gens, matrices = meta['generators'], flatfile.to_array(arrays['matrices'])
+        except (IOError, OSError, ValueError, KeyError, flatfile.FlatFileError):
+            gens = self.rho.generators()
+            letters = [''] + gens + [g.swapcase() for g in gens]
+            matrices = sl2matrix.pack_matrices([self(g) for g in letters])
+            flatfile.save(path, {'generators':gens}, {'matrices':matrices})
+        letters = [''] + gens + [g.swapcase() for g in gens]
+        self._generators = gens
+        self._letters = dict((g, sl2matrix.element_at(matrices, i, self.min_bits_accuracy, g))
+                             for i, g in enumerate(letters))
@@ -0,0 +1,99 @@
+"""
+A simple binary container for a handful of flat numeric arrays plus
+some JSON metadata.  The layout is::
+
+    b'QDFLAT01'           magic string
+    8 byte length n       little endian
+    n bytes of JSON       {"meta": ..., "arrays": {name: [typecode, offset, count]}}
+    array data            each array starts at a multiple of 8 bytes
+
+so each array can be used directly from a memory map of the file.
+Only typecodes whose size is the same on all platforms are allowed,
+so 'q' rather than 'l' for 64 bit integers.
+"""
+
+import json, mmap, os, struct, tempfile
+from array import array
+
+MAGIC = b'QDFLAT01'
+
+class FlatFileError(Exception):
+    pass
+
+def _padding(n):
+    return (-n) % 8
+
+def save(path, meta, arrays):
+    """
+    Writes the dict of arrays, whose values are array.array objects,
+    together with the JSON-able meta data.  The file is written under
+    a temporary name and then moved into place, so concurrent readers
+    never see a partial file.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'test.flat')
+    >>> save(path, {'radius':3}, {'x':array('d', [1.5, 2.5]), 'w':array('B', b'abc')})
+    >>> meta, arrays = load(path)
+    >>> meta['radius'], list(arrays['x']), bytes(arrays['w'])
+    (3, [1.5, 2.5], b'abc')
+    >>> save(path, {}, {'x':array('l', [1])})
+    Traceback (most recent call last):
+    ...
+    ValueError: Array x has the platform dependent typecode 'l'
+    """
+    layout, offset = dict(), 0
+    for name, A in sorted(arrays.items()):
+        if A.typecode in 'lL':
+            raise ValueError('Array %s has the platform dependent typecode %r'
+                             % (name, A.typecode))
+        layout[name] = [A.typecode, offset, len(A)]
+        nbytes = A.itemsize * len(A)
+        offset += nbytes + _padding(nbytes)
+    header = json.dumps({'meta':meta, 'arrays':layout}).encode('utf-8')
+    header += b' ' * _padding(len(MAGIC) + 8 + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for name, A in sorted(arrays.items()):
+                data = A.tobytes()
+                file.write(data + b'\0' * _padding(len(data)))
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+def to_array(view):
+    """
+    Copies one of the memoryviews returned by load into an array.array.
+    """
+    A = array(view.format)
+    A.frombytes(view.cast('B'))
+    return A
+
+def load(path, writable=False):
+    """
+    Returns the meta data and a dict of memoryviews, one per array,
+    backed by a memory map of the file.  The map is shared between
+    all processes that load the same file.  If writable is True, the
+    map is copy-on-write, which some consumers of the buffer
+    protocol require; the file itself is never changed.
+    """
+    with open(path, 'rb') as file:
+        access = mmap.ACCESS_COPY if writable else mmap.ACCESS_READ
+        data = mmap.mmap(file.fileno(), 0, access=access)
+    if data[:len(MAGIC)] != MAGIC:
+        raise FlatFileError('%s is not a flat array file' % path)
+    start = len(MAGIC) + 8
+    n = struct.unpack('<Q', data[len(MAGIC):start])[0]
+    header = json.loads(data[start:start + n].decode('utf-8'))
+    view = memoryview(data)
+    arrays = dict()
+    for name, (typecode, offset, count) in header['arrays'].items():
+        offset += start + n
+        nbytes = count * array(typecode).itemsize
+        arrays[name] = view[offset:offset + nbytes].cast(typecode)
+    return header['meta'], arrays
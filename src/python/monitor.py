@@ -0,0 +1,167 @@
+"""
+Observing the search in disorder.has_non_orderable_group.
+
+A monitor is passed as monitor= and is told about each node of the
+search, each saturation and each contradiction.  The search makes no
+calls at all when there is no monitor, so the default costs nothing.
+Monitor itself ignores everything and is the base class for new
+monitors; MetricsCollector aggregates what it is told into a dict
+that can be written as JSON.
+
+With workers, each worker reports to the monitor returned by the
+worker_monitor method of the monitor given, which is sent back to
+the parent and merged into it.
+"""
+
+import collections, json, time
+
+class Monitor(object):
+    def search_started(self, B):
+        """
+        The search of the ball B is about to begin.
+        """
+        pass
+
+    def node(self, depth, size):
+        """
+        The search reached a node at the given depth whose monoid has
+        the given size.
+        """
+        pass
+
+    def branched(self, depth, seconds):
+        """
+        Choosing the pair to branch on at a node took this long.
+        """
+        pass
+
+    def saturated(self, depth, before, after, seconds):
+        """
+        Saturating after adding a generator took this long and grew
+        the monoid from before to after elements.
+        """
+        pass
+
+    def contradiction(self, depth):
+        pass
+
+    def search_finished(self, B, ans):
+        """
+        The search of the ball B ended with the given answer; True
+        means a proof of nonorderability was found.
+        """
+        pass
+
+    def worker_monitor(self):
+        """
+        A new monitor for a worker to report to, which must be
+        picklable.  By default the workers are not observed.
+        """
+        return Monitor()
+
+    def merge(self, other):
+        """
+        Adds in what other, a monitor used in a worker, observed.
+        """
+        pass
+
+def _bucket(n):
+    """
+    The power of 2 at or below n, for histograms of sizes.
+    """
+    return 1 << (n.bit_length() - 1) if n > 0 else 0
+
+class MetricsCollector(Monitor):
+    """
+    Counts nodes and contradictions by depth, the time spent in
+    saturation and in choosing pairs, the sizes the monoids reach, and,
+    for each ball searched, how many products were evaluated and how
+    many of those landed in the ball.
+
+    >>> import snappy
+    >>> from quickdisorder import has_non_orderable_group
+    >>> metrics = MetricsCollector()
+    >>> has_non_orderable_group(snappy.Manifold('m003(-3,1)'), silent=True, monitor=metrics)
+    True
+    >>> data = metrics.as_dict()
+    >>> data['nodes_by_depth'], data['contradictions_by_depth']
+    ({'1': 1, '2': 2, '3': 2}, {'2': 1, '3': 2})
+    >>> data['saturations'], [ball['answer'] for ball in data['balls']]
+    (5, [True])
+
+    With workers, the workers' collectors are merged into this one.
+
+    >>> metrics = MetricsCollector()
+    >>> has_non_orderable_group(snappy.Manifold('m003(-3,1)'), silent=True,
+    ...                         workers=2, monitor=metrics)
+    True
+    >>> metrics.as_dict()['nodes']
+    5
+    """
+    def __init__(self):
+        self.nodes = collections.Counter()
+        self.contradictions = collections.Counter()
+        self.monoid_sizes = collections.Counter()
+        self.saturation_time = collections.Counter()
+        self.saturations = 0
+        self.elements_added = 0
+        self.branch_time = 0.0
+        self.balls = []
+        self._started = None
+
+    def search_started(self, B):
+        self._started = (time.perf_counter(), B.products_computed(), B.products_in_ball())
+
+    def node(self, depth, size):
+        self.nodes[depth] += 1
+
+    def branched(self, depth, seconds):
+        self.branch_time += seconds
+
+    def saturated(self, depth, before, after, seconds):
+        self.saturations += 1
+        self.elements_added += after - before
+        self.saturation_time[depth] += seconds
+        self.monoid_sizes[_bucket(after)] += 1
+
+    def contradiction(self, depth):
+        self.contradictions[depth] += 1
+
+    def search_finished(self, B, ans):
+        start, computed, in_ball = self._started
+        computed = B.products_computed() - computed
+        in_ball = B.products_in_ball() - in_ball
+        self.balls.append({'radius':B.radius, 'elements':len(B), 'answer':ans,
+                           'wall_time':time.perf_counter() - start,
+                           'products':computed, 'products_in_ball':in_ball,
+                           'hit_rate':float(in_ball) / computed if computed else None,
+                           'boundary':B.boundary_statistics()})
+
+    def worker_monitor(self):
+        return MetricsCollector()
+
+    def merge(self, other):
+        self.nodes.update(other.nodes)
+        self.contradictions.update(other.contradictions)
+        self.monoid_sizes.update(other.monoid_sizes)
+        self.saturation_time.update(other.saturation_time)
+        self.saturations += other.saturations
+        self.elements_added += other.elements_added
+        self.branch_time += other.branch_time
+
+    def as_dict(self):
+        histogram = lambda counter : dict((str(k), counter[k]) for k in sorted(counter))
+        return {'nodes':sum(self.nodes.values()),
+                'nodes_by_depth':histogram(self.nodes),
+                'contradictions_by_depth':histogram(self.contradictions),
+                'saturations':self.saturations,
+                'elements_added':self.elements_added,
+                'saturation_time':sum(self.saturation_time.values()),
+                'saturation_time_by_depth':histogram(self.saturation_time),
+                'branch_time':self.branch_time,
+                'monoid_sizes':histogram(self.monoid_sizes),
+                'balls':self.balls}
+
+    def write(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.as_dict(), file, indent=1)
@@ -0,0 +1,75 @@
+"""
+Learning from the contradictions found during the search.
+
+A nogood is a set of choices, i.e. ids of generators of the monoid,
+which cannot all be positive.  Each contradiction found with track=True
+gives one, namely the generators used in its expression of 1, and
+the search records these in a NogoodStore.  A later branch whose
+choices include a recorded nogood is closed at once with the same
+expression, without saturating.
+
+When both sides of a branch on {g, g^-1} fail, the choices the node
+really depends on are the union of those of its children with g and
+g^-1 removed.  The search keeps this in NogoodStore.last as it
+returns, so that if the subtree below g never used g, the node is
+closed by that subtree alone and g^-1 is not tried.
+
+Each nogood is filed under its smallest id, so looking up the choices
+of a node only looks at the nogoods filed under one of those choices,
+rather than at all of them.
+
+>>> store = NogoodStore()
+>>> store.learn(frozenset([3, 5]), ['a', 'b'])
+>>> store.learn(frozenset([1, 5]), ['c'])
+>>> store.learn(frozenset([3, 5, 7]), ['d'])
+>>> len(store)
+2
+>>> store.find(frozenset([1, 2, 3, 5]))
+(frozenset({3, 5}), ['a', 'b'])
+>>> store.find(frozenset([1, 3])) is None
+True
+"""
+
+class NogoodStore(object):
+    def __init__(self):
+        self.nogoods = []
+        self.last = frozenset()
+        self.hits = 0
+        # Maps the smallest id of each nogood to the positions in
+        # self.nogoods of the nogoods filed under it.
+        self._index = dict()
+
+    def add(self, nogood, word):
+        key = min(nogood) if nogood else None
+        self._index.setdefault(key, []).append(len(self.nogoods))
+        self.nogoods.append((nogood, word))
+
+    def learn(self, choices, word):
+        """
+        Records that the given choices give the expression word for 1.
+        """
+        self.last = choices
+        if self.find(choices, count=False) is None:
+            self.add(choices, word)
+
+    def find(self, choices, count=True):
+        """
+        The first recorded pair (nogood, word) with the nogood
+        contained in choices, or None.
+        """
+        index, first = self._index, None
+        for key in [None] + list(choices):
+            for n in index.get(key, ()):
+                if first is not None and n > first:
+                    break
+                if self.nogoods[n][0] <= choices:
+                    first = n
+                    break
+        if first is None:
+            return None
+        if count:
+            self.hits += 1
+        return self.nogoods[first]
+
+    def __len__(self):
+        return len(self.nogoods)
@@ -0,0 +1,163 @@
+"""
+Exploring the nonordering proof tree with a pool of processes.
+
+The top of the tree is expanded breadth first in the parent process
+until there are enough open nodes to keep the workers busy.  Each
+open node is then searched by a worker, which rebuilds the monoid at
+that node from the root by replaying the choices along the way.  The
+workers are forked, so they inherit the CayleyBall, with the lists of
+products computed while expanding the top of the tree, rather than
+receiving a pickled copy.  The lists each worker computes below its
+open nodes are its own, and are often computed again by the other
+workers, so the speedup from adding workers is well short of linear.
+"""
+
+import collections, multiprocessing
+from . import disorder, strategy as strategies
+
+# The state of the search, set in the parent just before the pool
+# is forked so that the workers inherit it.
+_search = dict()
+
+# How many open nodes to create per worker.
+tasks_per_worker = 4
+
+def replay(B, P, choices, biorder):
+    """
+    The monoid obtained from P by successively adding the elements
+    given by choices, a list of pairs (index of pair in
+    B.id_pairs, 0 or 1).
+    """
+    P = P.copy()
+    for k, side in choices:
+        P.saturate([B.pair_element(k, side)], biorder)
+    return P
+
+def explore(task):
+    """
+    Runs the sequential search below one open node in a worker.
+    Returns the index of the task, whether an order was found, the
+    leaves of the proof tree below the node, the numbers of nodes
+    and contradictions found below it, and the worker's monitor.
+    """
+    index, choices, edges, depth = task
+    B, biorder, trail = _search['ball'], _search['biorder'], _search['trail']
+    strategy = _search['strategy']
+    strategy.nodes = strategy.contradictions = 0
+    monitor = _search['monitor']
+    if monitor is not None:
+        monitor = monitor.worker_monitor()
+    P = replay(B, _search['monoid'], choices, biorder)
+    if _search['proof']:
+        printer = disorder.ProofPrinter(silent=True)
+        printer.edges_back_to_root = list(edges)
+    else:
+        printer = disorder.Printer(silent=True)
+    ans = disorder.ball_has_order(B, P, biorder, printer, depth, trail, strategy,
+                                  _search['nogoods'], monitor=monitor)[0]
+    leaves = printer.value if _search['proof'] else None
+    return index, ans, leaves, (strategy.nodes, strategy.contradictions), monitor
+
+def open_nodes(B, P, biorder, edges, target, strategy, monitor=None):
+    """
+    Expands the search tree breadth first until there are at least
+    target open nodes.  Returns None if an order was found on the
+    way, and otherwise the list of open nodes, as pairs (choices,
+    edge labels from the root), and the leaves closed so far.
+    """
+    queue = collections.deque([([], edges, P)])
+    leaves = []
+    while queue and len(queue) < target:
+        choices, edges, P = queue.popleft()
+        # The root was counted by the caller, and the nodes left open
+        # are counted by the workers.
+        if choices:
+            strategy.nodes += 1
+            if monitor is not None:
+                monitor.node(len(choices), len(P))
+        k = strategy.choose(B, P, biorder)
+        if k is None:
+            return None
+        for side in [0, 1]:
+            z = B.pair_element(k, side)
+            newP = P.copy()
+            newP.saturate([z], biorder)
+            new_edges = edges + [z.word]
+            if newP.has_one():
+                strategy.nodes += 1
+                strategy.contradictions += 1
+                if monitor is not None:
+                    monitor.node(len(choices) + 1, len(newP))
+                    monitor.contradiction(len(choices) + 1)
+                word = newP.word_rep_one() if newP.track else None
+                if word is not None:
+                    leaves.append(['.'.join(new_edges), '.'.join(word)])
+            else:
+                queue.append((choices + [(k, side)], new_edges, newP))
+    return [(choices, edges) for choices, edges, P in queue], leaves
+
+def ball_has_order(B, P, biorder, printer, recur_depth, trail=False, workers=2,
+                   strategy=None, nogoods=None, monitor=None):
+    """
+    Parallel version of disorder.ball_has_order.  The workers search
+    silently; as soon as one of them finds an order the rest are
+    cancelled.  Proof leaves are added to the printer in a fixed
+    order, independent of the order in which the workers finish.
+    Each worker learns nogoods on its own, starting from a copy of
+    the given store.
+    """
+    if strategy is None:
+        strategy = strategies.FirstPair()
+    strategy.nodes += 1
+    if monitor is not None:
+        monitor.node(recur_depth, len(P))
+    printer.size_of_monoid(P, recur_depth)
+    if P.has_one():
+        strategy.contradictions += 1
+        if monitor is not None:
+            monitor.contradiction(recur_depth)
+        word = P.word_rep_one() if P.track else None
+        printer.contradiction(word, recur_depth)
+        return False, P
+
+    proof = isinstance(printer, disorder.ProofPrinter)
+    edges = list(printer.edges_back_to_root) if proof else []
+    expanded = open_nodes(B, P, biorder, edges, tasks_per_worker * workers, strategy,
+                          monitor)
+    if expanded is None:
+        return True, P
+    nodes, leaves = expanded
+    tasks = [(i, choices, edges, recur_depth + len(choices))
+             for i, (choices, edges) in enumerate(nodes)]
+    if proof:
+        printer.extend(leaves)
+    if not tasks:
+        return False, P
+    printer.write('Searching %d subtrees with %d workers' % (len(tasks), workers),
+                  recur_depth)
+
+    _search.update(ball=B, monoid=P, biorder=biorder, trail=trail, proof=proof,
+                   strategy=strategy, nogoods=nogoods, monitor=monitor)
+    results = dict()
+    try:
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        try:
+            for index, ans, subtree_leaves, counts, worker_monitor in pool.imap_unordered(
+                    explore, tasks):
+                strategy.nodes += counts[0]
+                strategy.contradictions += counts[1]
+                if monitor is not None:
+                    monitor.merge(worker_monitor)
+                if ans:
+                    return True, P
+                results[index] = subtree_leaves
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        _search.clear()
+
+    if proof:
+        for i in range(len(tasks)):
+            printer.extend(results[i])
+    return False, P
@@ -0,0 +1,131 @@
+"""
+Strategies for choosing which pair {g, g^-1} to branch on at each
+node of the search in disorder.ball_has_order.
+
+A strategy is an object with a method choose(B, P, biorder) which
+returns the index in B.id_pairs of the pair to branch on, or None if
+the search should stop at P.  It also counts the nodes the search
+explored and how many of them were closed by a contradiction.  Pass
+an instance to has_non_orderable_group to read the counters
+afterwards, or just the name of one of the strategies below.
+"""
+
+import json
+
+def nearly_full(B, P):
+    """
+    Whether P is so close to the positive cone of an order on B that
+    the search should stop.
+    """
+    # If we get close to building a full P, we almost always get
+    # there.  It is better to stop now and later try again with an
+    # increased radius, because adding those last few elements is very
+    # expensive.
+    return len(P) > 0.9 * 0.5 * len(B)
+
+def undecided_pairs(B, P):
+    """
+    The indices of the pairs {g, g^-1} neither of which is in P, in
+    the order of B.id_pairs.
+    """
+    for k, (i, j) in enumerate(B.id_pairs):
+        if not (P.contains_id(i) or P.contains_id(j)):
+            yield k
+
+class FirstPair(object):
+    """
+    Branches on the first undecided pair, so on the shortest words
+    first, since the ball is built one word length at a time.
+    """
+    def __init__(self):
+        self.nodes = 0
+        self.contradictions = 0
+
+    def choose(self, B, P, biorder):
+        if nearly_full(B, P):
+            return None
+        for k in undecided_pairs(B, P):
+            return k
+        return None
+
+    def counters(self):
+        return {'nodes':self.nodes, 'contradictions':self.contradictions}
+
+class LargestGrowth(FirstPair):
+    """
+    Among the first few undecided pairs, branches on the one whose
+    two sides make P grow the most when added, counting a side which
+    gives a contradiction as growing P to the whole ball.  This costs
+    two trial saturations per candidate, but tends to give smaller
+    trees.
+    """
+    def __init__(self, candidates=4):
+        FirstPair.__init__(self)
+        self.candidates = candidates
+
+    def choose(self, B, P, biorder):
+        if nearly_full(B, P):
+            return None
+        best, best_score = None, -1
+        for n, k in enumerate(undecided_pairs(B, P)):
+            if n == self.candidates:
+                break
+            score = 0
+            for side in [0, 1]:
+                Q = P.copy()
+                Q.saturate([B.pair_element(k, side)], biorder)
+                score += len(B) if Q.has_one() else len(Q)
+            if score > best_score:
+                best, best_score = k, score
+        return best
+
+class RecordedOrder(FirstPair):
+    """
+    Branches on the pairs in the order their words first appear as
+    edge labels in an earlier proof, which is given as a JSON string
+    or as the corresponding dict, and then falls back to FirstPair.
+    The proof must come from a ball built the same way, so that the
+    words match.
+    """
+    def __init__(self, proof):
+        FirstPair.__init__(self)
+        if not isinstance(proof, dict):
+            proof = json.loads(proof)
+        self.words = []
+        for path, leaf in proof['proof']:
+            for word in path.split('.'):
+                if word not in self.words:
+                    self.words.append(word)
+        self._key, self._order = None, None
+
+    def _pairs_in_order(self, B):
+        # The pairs only change when the ball grows.
+        if self._key != (B, len(B.id_pairs)):
+            pair_of_word = dict()
+            for k, (q, p) in enumerate(B.pair_positions):
+                pair_of_word[B.words[q]] = pair_of_word[B.words[p]] = k
+            self._order = [pair_of_word[w] for w in self.words if w in pair_of_word]
+            self._key = (B, len(B.id_pairs))
+        return self._order
+
+    def choose(self, B, P, biorder):
+        if nearly_full(B, P):
+            return None
+        for k in self._pairs_in_order(B):
+            i, j = B.id_pairs[k]
+            if not (P.contains_id(i) or P.contains_id(j)):
+                return k
+        return FirstPair.choose(self, B, P, biorder)
+
+strategies = {'first':FirstPair, 'growth':LargestGrowth}
+
+def get_strategy(strategy):
+    """
+    The strategy given by a name in strategies, or the given strategy
+    object itself; None means 'first'.
+    """
+    if strategy is None:
+        return FirstPair()
+    if isinstance(strategy, str):
+        return strategies[strategy]()
+    return strategy
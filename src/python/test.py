@@ -1,5 +1,5 @@
 import doctest
-from . import double_group, disorder
+from . import double_group, ball, flatfile, checkpoint, nogood, disorder, monitor, benchmark
 
-for module in [double_group, disorder]:
+for module in [double_group, ball, flatfile, checkpoint, nogood, disorder, monitor, benchmark]:
     print(module.__name__ + ': ' + repr(doctest.testmod(module)))